@@ -2,11 +2,16 @@ import streamlit as st
 import os
 import json
 from datetime import datetime
-import requests
 import time
 import random
 import hashlib
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from urllib.parse import quote_plus
+from http_client import PROVIDER_GENERATION_TIMEOUT, download_file, provider_get, provider_post
+from image_store import add_image, invalidate_images, touch_images, trip_id
+from provider_cache import image_resolutions, normalize_query, search_cache
 import base64
 
 # Set page configuration
@@ -47,10 +52,52 @@ PEXELS_API_KEY = st.secrets.get("PEXELS_API_KEY", "")
 # For image generation, we'll use Hugging Face Inference API
 HUGGINGFACE_API_KEY = st.secrets.get("HUGGINGFACE_API_KEY", "")
 
-# Image cache tracking
-image_cache = {}
+# Image lookups run in parallel; each one mostly waits on a provider or a download
+IMAGE_LOOKUP_WORKERS = 8
+
+# Queries used on this run, so each activity gets its own. They start afresh on
+# every run, and every activity's query is chosen on every run (cached image or
+# not), so an activity always gets the same query.
 used_queries = set()
-used_image_urls = set()
+
+# Image URLs this session has already shown, so its images don't repeat. These
+# are kept per session; the resolved images themselves are cached for the whole
+# server in provider_cache.image_resolutions.
+used_image_urls = st.session_state.setdefault('used_image_urls', set())
+
+# What images downloaded on this run are recorded as fetched for in the image
+# cache index, so they can be invalidated without affecting other trips
+if 'session_key' not in st.session_state:
+    st.session_state.session_key = uuid.uuid4().hex
+image_scope = {
+    'destination': st.session_state.destination,
+    'trip': trip_id(st.session_state.destination, daily_plan),
+    'session': st.session_state.session_key
+}
+
+# Guards used_image_urls and image_errors, which the lookup threads share
+image_state_lock = threading.Lock()
+
+# Provider errors from the lookup threads, shown once all images are resolved
+# (Streamlit elements can only be created from the script's own thread)
+image_errors = []
+
+def report_image_error(message):
+    with image_state_lock:
+        image_errors.append(message)
+
+def pick_unused_url(urls, idx):
+    """Pick one of a provider's result URLs, preferring those not shown yet, and mark it used"""
+    with image_state_lock:
+        unused_urls = [url for url in urls if url not in used_image_urls]
+        
+        # If all images are used, resort to using any available
+        if not unused_urls:
+            unused_urls = urls
+        
+        image_url = unused_urls[idx % len(unused_urls)]
+        used_image_urls.add(image_url)
+    return image_url
 
 # Function to create unique cache keys
 def create_cache_key(query, source, idx=0, activity_type=""):
@@ -117,6 +164,12 @@ def generate_enhanced_query(location, activity, index=0):
     # Return a different query based on the index to ensure variety
     return unique_queries[index % len(unique_queries)], activity_type
 
+def fetch_search_results(url, headers):
+    """Run a provider search and return its JSON response (errors are raised, so they aren't cached)"""
+    response = provider_get(url, headers=headers)
+    response.raise_for_status()
+    return response.json()
+
 # Function to get image from Unsplash API
 def get_unsplash_image(query, idx=0, activity_type=""):
     """Get a relevant image from Unsplash API"""
@@ -133,40 +186,26 @@ def get_unsplash_image(query, idx=0, activity_type=""):
     
     try:
         # Use API key-based approach
-        encoded_query = quote_plus(query)
+        search_query = normalize_query(query)
+        encoded_query = quote_plus(search_query)
         url = f"https://api.unsplash.com/search/photos?query={encoded_query}&per_page=30&orientation=landscape"
         
         headers = {
             "Authorization": f"Client-ID {UNSPLASH_ACCESS_KEY}"
         }
         
-        response = requests.get(url, headers=headers)
-        data = response.json()
+        # One page of results serves every image picked for this query
+        data = search_cache.get(("unsplash", search_query, "landscape"), lambda: fetch_search_results(url, headers))
         
         if "results" in data and len(data["results"]) > 0:
-            results = data["results"]
-            
-            # Filter out already used images
-            unused_results = [r for r in results if r["urls"]["regular"] not in used_image_urls]
-            
-            # If all images are used, resort to using any available
-            if not unused_results:
-                unused_results = results
-            
-            result_idx = idx % len(unused_results)
-            image_url = unused_results[result_idx]["urls"]["regular"]
-            
-            # Mark this URL as used
-            used_image_urls.add(image_url)
+            image_url = pick_unused_url([r["urls"]["regular"] for r in data["results"]], idx)
             
             # Download and cache the image
-            img_response = requests.get(image_url)
-            if img_response.status_code == 200:
-                with open(cache_file, 'wb') as f:
-                    f.write(img_response.content)
-                return cache_file
+            download_file(image_url, cache_file)
+            add_image(cache_file, "unsplash", **image_scope)
+            return cache_file
     except Exception as e:
-        st.warning(f"Unsplash image retrieval error: {str(e)}")
+        report_image_error(f"Unsplash image retrieval error: {str(e)}")
     
     return get_placeholder_image(idx)
 
@@ -186,7 +225,8 @@ def get_pexels_image(query, idx=0, activity_type=""):
     
     try:
         # Encode the search query
-        encoded_query = quote_plus(query)
+        search_query = normalize_query(query)
+        encoded_query = quote_plus(search_query)
         
         # API endpoint
         url = f"https://api.pexels.com/v1/search?query={encoded_query}&per_page=30&orientation=landscape"
@@ -195,34 +235,18 @@ def get_pexels_image(query, idx=0, activity_type=""):
             "Authorization": PEXELS_API_KEY
         }
         
-        response = requests.get(url, headers=headers)
-        data = response.json()
+        # One page of results serves every image picked for this query
+        data = search_cache.get(("pexels", search_query, "landscape"), lambda: fetch_search_results(url, headers))
         
         if "photos" in data and len(data["photos"]) > 0:
-            photos = data["photos"]
-            
-            # Filter out already used images
-            unused_photos = [p for p in photos if p["src"]["large"] not in used_image_urls]
-            
-            # If all images are used, resort to using any available
-            if not unused_photos:
-                unused_photos = photos
-            
-            photo_idx = idx % len(unused_photos)
-            photo = unused_photos[photo_idx]
-            image_url = photo["src"]["large"]
-            
-            # Mark this URL as used
-            used_image_urls.add(image_url)
+            image_url = pick_unused_url([p["src"]["large"] for p in data["photos"]], idx)
             
             # Download and cache the image
-            img_response = requests.get(image_url)
-            if img_response.status_code == 200:
-                with open(cache_file, 'wb') as f:
-                    f.write(img_response.content)
-                return cache_file
+            download_file(image_url, cache_file)
+            add_image(cache_file, "pexels", **image_scope)
+            return cache_file
     except Exception as e:
-        st.warning(f"Pexels image retrieval error: {str(e)}")
+        report_image_error(f"Pexels image retrieval error: {str(e)}")
     
     return get_placeholder_image(idx)
 
@@ -272,15 +296,16 @@ def get_huggingface_image(query, idx=0, activity_type=""):
             }
         }
         
-        response = requests.post(url, headers=headers, json=payload)
+        response = provider_post(url, headers=headers, json=payload, timeout=PROVIDER_GENERATION_TIMEOUT)
         
         # Check if the response is valid image data
         if response.status_code == 200:
             with open(cache_file, 'wb') as f:
                 f.write(response.content)
+            add_image(cache_file, "huggingface", **image_scope)
             return cache_file
     except Exception as e:
-        st.warning(f"Hugging Face image generation error: {str(e)}")
+        report_image_error(f"Hugging Face image generation error: {str(e)}")
     
     return get_placeholder_image(idx)
 
@@ -302,10 +327,9 @@ def get_placeholder_image(idx=0):
     
     if not os.path.exists(cache_file):
         try:
-            img_response = requests.get(placeholder_url)
-            if img_response.status_code == 200:
-                with open(cache_file, 'wb') as f:
-                    f.write(img_response.content)
+            # Placeholders are shared by every trip, so they get no scope
+            download_file(placeholder_url, cache_file)
+            add_image(cache_file, "placeholder")
         except:
             # Fall back to a local placeholder
             return "https://via.placeholder.com/600x400?text=Travel+Image"
@@ -341,11 +365,8 @@ def generate_image_description(location, activity):
         return f"Exploring {activity} in the beautiful destination of {location}."
 
 # Function to get smart image
-def get_smart_image(location, activity, index=0):
-    """Smart function to get the most relevant image using multiple sources"""
-    # Create a unique context-based query
-    query, activity_type = generate_enhanced_query(location, activity, index)
-    
+def fetch_smart_image(query, activity_type, index=0):
+    """Smart function to get the most relevant image for a prepared query using multiple sources"""
     # Use different API source based on context and availability
     image_sources = []
     
@@ -363,9 +384,9 @@ def get_smart_image(location, activity, index=0):
     if not image_sources:
         return get_placeholder_image(index)
     
-    # Shuffle sources based on index to ensure variety
-    random.seed(index)
-    random.shuffle(image_sources)
+    # Shuffle sources based on index to ensure variety (with a private generator,
+    # since lookups run on several threads at once)
+    random.Random(index).shuffle(image_sources)
     
     # Try each source
     for img_func, source_name in image_sources:
@@ -382,113 +403,120 @@ def get_smart_image(location, activity, index=0):
     return get_placeholder_image(index)
 
 # Activity fingerprint to ensure uniqueness
-def create_activity_fingerprint(location, activity, day_idx, period_idx):
-    """Create a unique fingerprint for this specific activity instance"""
-    return f"{location}_{activity}_{day_idx}_{period_idx}"
-
-# Function to get unique image for each activity
-def get_unique_activity_image(location, activity, day_idx, period_idx):
-    """Ensure each activity gets a unique image"""
-    # Create a unique identifier for this activity instance
-    activity_fingerprint = create_activity_fingerprint(location, activity, day_idx, period_idx)
-    
-    # Check if we already have an image for this exact activity instance
-    if activity_fingerprint in image_cache:
-        return image_cache[activity_fingerprint]
-    
-    # Calculate base index using day and period for deterministic results
-    base_idx = (day_idx * 100) + (period_idx * 10)
-    
-    # Get image
-    image_path = get_smart_image(location, activity, base_idx)
-    
-    # Cache the result
-    image_cache[activity_fingerprint] = image_path
-    return image_path
+def create_activity_fingerprint(trip, location, activity, day_idx, period_idx):
+    """Create a unique fingerprint for this specific activity instance (trip is a trip_id)"""
+    return (trip, location, activity, day_idx, period_idx)
+
+def cached_image(key):
+    """Return the image already resolved for an activity, if it is still on disk"""
+    image_path = image_resolutions.get(key)
+    return image_path if image_path and os.path.exists(image_path) else None
+
+def resolve_images(lookups, on_resolved):
+    """
+    Find the images for several activities concurrently
+
+    Parameters:
+    - lookups: List of (activity fingerprint, location, activity, index) tuples
+    - on_resolved: Called on the calling thread with (key, image path) as each image is found
+    """
+    # Queries are chosen up front and in order, as each one steers clear of
+    # those already taken, so the same itinerary always gets the same queries.
+    # That includes the activities whose image is cached, or the queries of
+    # those after them would shift.
+    prepared = {}
+    resolved_paths = []
+    for key, location, activity, index in lookups:
+        query, activity_type = generate_enhanced_query(location, activity, index)
+        image_path = cached_image(key)
+        if image_path:
+            resolved_paths.append(image_path)
+            on_resolved(key, image_path)
+        elif key not in prepared:
+            prepared[key] = (query, activity_type, index)
+    
+    if prepared:
+        executor = ThreadPoolExecutor(max_workers=min(IMAGE_LOOKUP_WORKERS, len(prepared)))
+        try:
+            futures = {
+                executor.submit(fetch_smart_image, query, activity_type, index): (key, index)
+                for key, (query, activity_type, index) in prepared.items()
+            }
+            for future in as_completed(futures):
+                key, index = futures[future]
+                try:
+                    image_path = future.result()
+                except Exception as e:
+                    report_image_error(f"Image lookup error: {str(e)}")
+                    image_path = get_placeholder_image(index)
+                # Remote fallbacks mean the download failed; try again next time
+                if os.path.exists(image_path):
+                    image_resolutions.put(key, image_path)
+                    resolved_paths.append(image_path)
+                on_resolved(key, image_path)
+        finally:
+            # A rerun or stop (e.g. a button click) interrupts the script here;
+            # don't make it wait for the lookups still in flight
+            executor.shutdown(wait=False, cancel_futures=True)
+    
+    # Images on show are the last to be evicted from the disk cache
+    touch_images(resolved_paths)
+
+def image_placeholder_html(message):
+    """A light box shown where an image will appear once it has been found"""
+    return (
+        '<div style="aspect-ratio: 3 / 2; width: 100%; display: flex; align-items: center; '
+        'justify-content: center; background: rgba(128, 128, 128, 0.12); border-radius: 0.5rem; '
+        f'color: rgba(128, 128, 128, 0.9); font-size: 0.9rem; text-align: center; padding: 1rem;">{message}</div>'
+    )
 
 # Clear cache for forced refresh
 if st.session_state.get('refresh_images', False):
-    # Clear memory caches
-    image_cache.clear()  
+    # Clear memory caches (only this trip's resolutions; other trips keep theirs)
+    image_resolutions.discard_matching(lambda key: key[0] == image_scope['trip'])
     used_queries.clear()
     used_image_urls.clear()
     
-    # Clear file cache if requested
-    for file in os.listdir('data/images'):
-        if file.endswith('.jpg'):
-            try:
-                os.remove(os.path.join('data/images', file))
-            except:
-                pass
-                
+    # Delete the images first downloaded for this trip; shared placeholders and
+    # other trips' images stay, even for the same destination
+    invalidate_images(trip=image_scope['trip'])
+    
     st.session_state.refresh_images = False
 
+# Every image cell is laid out first with a placeholder, and all the images are
+# then looked up at once, each one filling in its cell as soon as it is found
+image_slots = {}
+image_captions = {}
+image_lookups = []
+
+def add_image_slot(key, activity, index, caption):
+    image_slots[key] = st.empty()
+    image_slots[key].markdown(image_placeholder_html(f"Finding image for {activity}..."), unsafe_allow_html=True)
+    image_captions[key] = caption
+    image_lookups.append((key, st.session_state.destination, activity, index))
+
 # Display daily activities with images
 for day_idx, day in enumerate(daily_plan):
     st.markdown(f"### Day {day['day']}: {day['day_name']}")
 
     # Create three columns for morning, afternoon, and evening
-    col1, col2, col3 = st.columns(3)
-
-    # Morning activity
-    with col1:
-        st.subheader("Morning")
-        morning_activity = day.get('morning', {}).get('title', '')
-        description = day.get('morning', {}).get('description', '')
-        if morning_activity:
-            with st.spinner(f"Finding image for {morning_activity}..."):
-                image_path = get_unique_activity_image(
-                    st.session_state.destination, 
-                    morning_activity, 
-                    day_idx, 
-                    0
-                )
-                # Generate enhanced description
-                enhanced_description = generate_image_description(st.session_state.destination, morning_activity)
-                st.image(image_path, caption=enhanced_description, use_container_width=True)
-                st.markdown(f"**{morning_activity}**")
-                if description:
-                    with st.expander("Details"):
-                        st.write(description)
-
-    # Afternoon activity
-    with col2:
-        st.subheader("Afternoon")
-        afternoon_activity = day.get('afternoon', {}).get('title', '')
-        description = day.get('afternoon', {}).get('description', '')
-        if afternoon_activity:
-            with st.spinner(f"Finding image for {afternoon_activity}..."):
-                image_path = get_unique_activity_image(
-                    st.session_state.destination, 
-                    afternoon_activity, 
-                    day_idx, 
-                    1
-                )
-                # Generate enhanced description
-                enhanced_description = generate_image_description(st.session_state.destination, afternoon_activity)
-                st.image(image_path, caption=enhanced_description, use_container_width=True)
-                st.markdown(f"**{afternoon_activity}**")
-                if description:
-                    with st.expander("Details"):
-                        st.write(description)
-
-    # Evening activity
-    with col3:
-        st.subheader("Evening")
-        evening_activity = day.get('evening', {}).get('title', '')
-        description = day.get('evening', {}).get('description', '')
-        if evening_activity:
-            with st.spinner(f"Finding image for {evening_activity}..."):
-                image_path = get_unique_activity_image(
-                    st.session_state.destination, 
-                    evening_activity, 
-                    day_idx, 
-                    2
+    columns = st.columns(3)
+
+    for period_idx, period in enumerate(['morning', 'afternoon', 'evening']):
+        with columns[period_idx]:
+            st.subheader(period.capitalize())
+            activity = day.get(period, {}).get('title', '')
+            description = day.get(period, {}).get('description', '')
+            if activity:
+                # Base index from day and period for deterministic results
+                add_image_slot(
+                    create_activity_fingerprint(image_scope['trip'], st.session_state.destination, activity, day_idx, period_idx),
+                    activity,
+                    (day_idx * 100) + (period_idx * 10),
+                    # Generate enhanced description
+                    generate_image_description(st.session_state.destination, activity)
                 )
-                # Generate enhanced description
-                enhanced_description = generate_image_description(st.session_state.destination, evening_activity)
-                st.image(image_path, caption=enhanced_description, use_container_width=True)
-                st.markdown(f"**{evening_activity}**")
+                st.markdown(f"**{activity}**")
                 if description:
                     with st.expander("Details"):
                         st.write(description)
@@ -514,16 +542,15 @@ if highlights:
     cols = st.columns(3)
     for idx, highlight in enumerate(highlights[:6]):  # Show top 6 highlights
         with cols[idx % 3]:
-            with st.spinner(f"Finding highlight image..."):
-                # Use a different approach for highlights
-                image_path = get_smart_image(
-                    st.session_state.destination, 
-                    highlight['activity'],
-                    1000 + idx  # Use 1000+ to ensure different from main listing
-                )
-                # Generate custom caption
-                caption = generate_image_description(st.session_state.destination, highlight['activity'])
-                st.image(image_path, caption=f"Day {highlight['day']}: {highlight['activity']}", use_container_width=True)
+            # Use 1000+ to ensure different images from the main listing
+            add_image_slot(
+                create_activity_fingerprint(image_scope['trip'], st.session_state.destination, highlight['activity'], "highlight", idx),
+                highlight['activity'],
+                1000 + idx,
+                f"Day {highlight['day']}: {highlight['activity']}"
+            )
+
+image_error_area = st.container()
 
 # Navigation buttons
 st.markdown("---")
@@ -549,4 +576,13 @@ with col4:
                    'itinerary', 'video_path', 'cinematic_trailer']:
             if key in st.session_state:
                 del st.session_state[key]
-        st.switch_page("main.py")
\ No newline at end of file
+        st.switch_page("main.py")
+
+# Look the images up last, so the whole page (buttons included) is usable while they load
+def show_resolved_image(key, image_path):
+    image_slots[key].image(image_path, caption=image_captions[key], use_container_width=True)
+
+resolve_images(image_lookups, show_resolved_image)
+with image_error_area:
+    for message in dict.fromkeys(image_errors):
+        st.warning(message)
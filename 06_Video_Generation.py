@@ -1,18 +1,17 @@
 import streamlit as st
 import os
-import cv2
-import numpy as np
-from PIL import Image
 import tempfile
-import time
-import requests
 import random
-from datetime import datetime
-import subprocess
-import json
+import hashlib
 import shutil
-import base64
-import io
+import time
+import uuid
+from http_client import download_file, download_files
+from image_store import add_image, touch_images, trip_id
+from render_jobs import TERMINAL_STATES, cancel_job, cpu_budget, get_job_status, submit_render_job
+from scratch import JOB_SCRATCH_QUOTA_MB, scratch_bytes
+from video_encoder import HLS_PLAYLIST_NAME, ffmpeg_available
+from video_renderer import choose_transitions, estimate_render, hash_file, render_cache_key
 
 # Set page configuration
 st.set_page_config(
@@ -31,6 +30,37 @@ if not os.path.exists('data/audio'):
 if not os.path.exists('data/frames'):
     os.makedirs('data/frames')
 
+# Set TRAILER_DEBUG_FRAMES=1 to also save every rendered frame under data/frames
+DEBUG_DUMP_FRAMES = os.environ.get("TRAILER_DEBUG_FRAMES", "") == "1"
+
+# Finished videos are published here and served by Streamlit's static file
+# server (server.enableStaticServing), which supports seeking with range requests
+STATIC_VIDEO_DIR = os.path.join('static', 'videos')
+
+# Streamed renders write their HLS playlist and segments into a directory here
+STATIC_STREAM_DIR = os.path.join('static', 'streams')
+
+# Streamlit's static file server answers 404 for files over 200 MB, and turns
+# static serving off at startup if the static folder holds over 1 GB. Bigger
+# videos are played through Streamlit instead, and the published videos are
+# kept well under the folder limit, oldest removed first, to leave room for streams.
+STATIC_FILE_MAX_BYTES = 200 * 1024 * 1024
+STATIC_FOLDER_MAX_BYTES = 1024 * 1024 * 1024
+STATIC_VIDEO_MAX_BYTES = 640 * 1024 * 1024
+
+# Stream directories left this long (e.g. by a crashed server) are removed
+STATIC_STREAM_MAX_AGE = 24 * 3600
+
+# Extra versions of the video that can be made from the same render: (width, height).
+# Captions are drawn into the composed frames, so every version must keep their
+# aspect ratio; a cropped one (e.g. vertical for phones) would cut the captions off.
+EXTRA_RENDITIONS = {
+    "720p (smaller file)": (1280, 720),
+}
+
+# Settings of the quick draft preview rendered before the full-quality video
+DRAFT_PREVIEW_SETTINGS = {'width': 640, 'height': 360, 'fps': 12, 'preset': 'draft', 'transition_types': ['fade']}
+
 # Check if we have the necessary data to proceed
 if 'destination' not in st.session_state or not st.session_state.destination:
     st.switch_page("pages/01_Destination_and_Budget.py")
@@ -41,8 +71,13 @@ if 'itinerary' not in st.session_state or not st.session_state.itinerary:
 st.title("🎬 Cinematic Trip Experience")
 st.markdown(f"### Create a cinematic video preview of your trip to {st.session_state.destination}")
 
+# Seed for every random choice made for this trip, so identical trips get identical videos
+def get_trip_seed():
+    """Hash the destination and daily plan into a stable seed"""
+    return trip_id(st.session_state.destination, st.session_state.itinerary.get('daily_plan', []))
+
 # Function to fetch relevant images for a place using Unsplash API
-def fetch_place_images(place_name, max_images=3):
+def fetch_place_images(place_name, max_images=3, rng=random):
     """Fetch images related to a specific place using Unsplash API or fallback sources"""
     # For demo purposes, we'll use a list of predefined travel images by location type
     # In production, you would use the Unsplash API with proper API keys
@@ -122,14 +157,35 @@ def fetch_place_images(place_name, max_images=3):
             matched_images = image_categories["city"]
     
     # Randomize and limit the number of images
-    random.shuffle(matched_images)
+    rng.shuffle(matched_images)
     return matched_images[:max_images]
 
+# Function to drop repeated pictures from the image pool
+def deduplicate_images(images):
+    """Keep one entry per distinct image content, preferring the most important use of it"""
+    content_hashes = {}
+    best = {}
+    for img in images:
+        if img['path'] not in content_hashes:
+            content_hashes[img['path']] = hash_file(img['path'])
+        content_hash = content_hashes[img['path']]
+        
+        current = best.get(content_hash)
+        if current is None or img['importance'] > current['importance']:
+            best[content_hash] = img
+    
+    # Keep the original order of the entries that remain
+    kept = {id(img) for img in best.values()}
+    return [img for img in images if id(img) in kept]
+
 # Improved function to collect images that match the itinerary places
 def collect_matching_images(max_images=20):
     """Collect images that match the places mentioned in the itinerary"""
     all_images = []
     
+    # Seeded by the trip so the same itinerary always selects the same images
+    rng = random.Random(get_trip_seed())
+    
     # Get daily plan from the itinerary
     daily_plan = st.session_state.itinerary.get('daily_plan', [])
     
@@ -138,6 +194,10 @@ def collect_matching_images(max_images=20):
     if not os.path.exists(temp_img_dir):
         os.makedirs(temp_img_dir)
     
+    # Local file of each distinct image URL, downloaded together once every activity
+    # has been matched; activities that share a URL share the file
+    url_paths = {}
+    
     # Process each activity in the itinerary
     for day_idx, day in enumerate(daily_plan):
         for period_idx, period in enumerate(['morning', 'afternoon', 'evening']):
@@ -164,32 +224,42 @@ def collect_matching_images(max_images=20):
                     importance_score += 2
                 
                 # Fetch relevant images for this activity
-                image_urls = fetch_place_images(activity, max_images=3)
+                image_urls = fetch_place_images(activity, max_images=3, rng=rng)
                 
-                # Download and save images
-                for img_idx, url in enumerate(image_urls):
-                    try:
-                        # Create a unique filename for this image
-                        img_filename = f"{temp_img_dir}/day{day['day']}_{period}_{img_idx}.jpg"
-                        
-                        # Check if file already exists
-                        if not os.path.exists(img_filename):
-                            response = requests.get(url)
-                            if response.status_code == 200:
-                                with open(img_filename, 'wb') as f:
-                                    f.write(response.content)
-                        
-                        # Add image to the collection
-                        all_images.append({
-                            'path': img_filename,
-                            'caption': f"Day {day['day']} - {period.capitalize()}: {activity}",
-                            'day': day['day'],
-                            'period': period,
-                            'activity': activity,
-                            'importance': importance_score
-                        })
-                    except Exception as e:
-                        st.warning(f"Error downloading image for {activity}: {str(e)}")
+                # Queue the images for download
+                for url in image_urls:
+                    # Name the file after its URL so each image is downloaded only once
+                    if url not in url_paths:
+                        url_paths[url] = f"{temp_img_dir}/url_{hashlib.sha1(url.encode()).hexdigest()[:16]}.jpg"
+                    img_filename = url_paths[url]
+                    
+                    # Add image to the collection
+                    all_images.append({
+                        'path': img_filename,
+                        'caption': f"Day {day['day']} - {period.capitalize()}: {activity}",
+                        'day': day['day'],
+                        'period': period,
+                        'activity': activity,
+                        'importance': importance_score
+                    })
+    
+    # Download everything not already on disk over a shared pool of connections
+    cached_paths = [path for path in url_paths.values() if os.path.exists(path)]
+    download_errors = download_files(url_paths.items())
+    for img in all_images:
+        if img['path'] in download_errors:
+            st.warning(f"Error downloading image for {img['activity']}: {download_errors[img['path']]}")
+    all_images = [img for img in all_images if os.path.exists(img['path'])]
+    
+    # Record the images in the image cache index; these stock photos are shared
+    # by every destination, so they get no destination to be invalidated with
+    touch_images(cached_paths)
+    for path in set(url_paths.values()) - set(cached_paths) - set(download_errors):
+        add_image(path, "stock", trip=get_trip_seed(), session=st.session_state.get('session_key'))
+    
+    # Different URLs can still be the same picture; keep one entry per picture so
+    # the selection below doesn't spend slots on repeats
+    all_images = deduplicate_images(all_images)
     
     # Select images ensuring we have distributed coverage of the trip
     selected_images = []
@@ -250,24 +320,22 @@ def collect_matching_images(max_images=20):
         ]
         
         # Download placeholders if needed
-        for i, url in enumerate(placeholder_paths):
-            cache_file = f"data/images/placeholder_{i}.jpg"
-            if not os.path.exists(cache_file):
-                try:
-                    img_response = requests.get(url)
-                    if img_response.status_code == 200:
-                        with open(cache_file, 'wb') as f:
-                            f.write(img_response.content)
-                        selected_images.append({
-                            'path': cache_file,
-                            'caption': f"Placeholder image {i+1}",
-                            'day': i+1,
-                            'period': 'morning',
-                            'activity': f"Activity {i+1}",
-                            'importance': 0
-                        })
-                except Exception as e:
-                    st.error(f"Error downloading placeholder image: {str(e)}")
+        placeholder_files = [(url, f"data/images/placeholder_{i}.jpg") for i, url in enumerate(placeholder_paths)]
+        for cache_file, error in download_files(placeholder_files).items():
+            st.error(f"Error downloading placeholder image: {error}")
+        for url, cache_file in placeholder_files:
+            add_image(cache_file, "placeholder")
+        
+        for i, (url, cache_file) in enumerate(placeholder_files):
+            if os.path.exists(cache_file):
+                selected_images.append({
+                    'path': cache_file,
+                    'caption': f"Placeholder image {i+1}",
+                    'day': i+1,
+                    'period': 'morning',
+                    'activity': f"Activity {i+1}",
+                    'importance': 0
+                })
     
     # Sort final selection by day and period
     period_order = {'morning': 0, 'afternoon': 1, 'evening': 2}
@@ -284,7 +352,7 @@ def collect_matching_images(max_images=20):
     
     # Shuffle within each day
     for day in days:
-        random.shuffle(days[day])
+        rng.shuffle(days[day])
     
     # Reconstruct the list in day order but with randomized content within each day
     final_selection = []
@@ -293,117 +361,8 @@ def collect_matching_images(max_images=20):
     
     return final_selection
 
-# Function to apply cinematic transitions between images
-def apply_transition(img1, img2, transition_type, progress):
-    """Apply cinematic transition between two images"""
-    if transition_type == "fade":
-        return cv2.addWeighted(img1, 1 - progress, img2, progress, 0)
-    elif transition_type == "slide_left":
-        width = img1.shape[1]
-        offset = int(progress * width)
-        result = np.copy(img1)
-        result[:, 0:width-offset] = img1[:, offset:width]
-        result[:, width-offset:width] = img2[:, 0:offset]
-        return result
-    elif transition_type == "slide_right":
-        width = img1.shape[1]
-        offset = int(progress * width)
-        result = np.copy(img1)
-        result[:, offset:width] = img1[:, 0:width-offset]
-        result[:, 0:offset] = img2[:, width-offset:width]
-        return result
-    elif transition_type == "zoom_in":
-        scale = 1 + (0.3 * progress)
-        h, w = img1.shape[:2]
-        center_x, center_y = w // 2, h // 2
-        
-        # Interpolate between images
-        blended = cv2.addWeighted(img1, 1 - progress, img2, progress, 0)
-        
-        # Calculate new dimensions
-        new_h, new_w = int(h * scale), int(w * scale)
-        
-        # Scale image up
-        scaled = cv2.resize(blended, (new_w, new_h))
-        
-        # Calculate crop region
-        start_x = (new_w - w) // 2
-        start_y = (new_h - h) // 2
-        end_x = start_x + w
-        end_y = start_y + h
-        
-        # Crop to original size
-        result = scaled[start_y:end_y, start_x:end_x]
-        return result
-    else:  # Default: fade
-        return cv2.addWeighted(img1, 1 - progress, img2, progress, 0)
-
-# Function to resize images to standard dimensions
-def resize_image(image_path, target_width=1920, target_height=1080):
-    """Resize image for video with cinematic aspect ratio"""
-    try:
-        img = Image.open(image_path)
-        img = img.convert('RGB')  # Ensure RGB mode
-        
-        # Calculate aspect ratios
-        img_aspect = img.width / img.height
-        target_aspect = target_width / target_height
-        
-        # Resize and crop to maintain aspect ratio without stretching
-        if img_aspect > target_aspect:  # Image is wider than target
-            # Resize based on height
-            new_height = target_height
-            new_width = int(new_height * img_aspect)
-            img_resized = img.resize((new_width, new_height), Image.LANCZOS)
-            
-            # Crop the width to match target aspect ratio
-            left_margin = (new_width - target_width) // 2
-            img_cropped = img_resized.crop((left_margin, 0, left_margin + target_width, target_height))
-        else:  # Image is taller than target
-            # Resize based on width
-            new_width = target_width
-            new_height = int(new_width / img_aspect)
-            img_resized = img.resize((new_width, new_height), Image.LANCZOS)
-            
-            # Crop the height to match target aspect ratio
-            top_margin = (new_height - target_height) // 2
-            img_cropped = img_resized.crop((0, top_margin, target_width, top_margin + target_height))
-        
-        # Convert to numpy array for OpenCV
-        return np.array(img_cropped)
-    except Exception as e:
-        st.error(f"Error processing image {image_path}: {str(e)}")
-        # Return a black image as fallback
-        return np.zeros((target_height, target_width, 3), dtype=np.uint8)
-
-# Function to add text overlay to image
-def add_caption(img, caption, font_scale=1.2, thickness=2):
-    """Add a stylish caption to the image"""
-    img_with_text = img.copy()
-    height, width = img.shape[:2]
-    
-    # Black semi-transparent background for text
-    overlay = img.copy()
-    bottom_rect_height = int(height * 0.12)  # 12% of image height
-    cv2.rectangle(overlay, (0, height - bottom_rect_height), (width, height), (0, 0, 0), -1)
-    img_with_text = cv2.addWeighted(overlay, 0.7, img_with_text, 0.3, 0)
-    
-    # Text settings
-    font = cv2.FONT_HERSHEY_DUPLEX
-    text_color = (255, 255, 255)  # White text
-    
-    # Calculate position and size
-    text_size = cv2.getTextSize(caption, font, font_scale, thickness)[0]
-    text_x = (width - text_size[0]) // 2  # Center text horizontally
-    text_y = height - (bottom_rect_height // 2) + (text_size[1] // 2)  # Center in overlay
-    
-    # Add text
-    cv2.putText(img_with_text, caption, (text_x, text_y), font, font_scale, text_color, thickness)
-    
-    return img_with_text
-
 # Function to download royalty-free music (simulated)
-def get_background_music(mood="inspiring"):
+def get_background_music(mood="inspiring", seed=None):
     """Get appropriate background music based on destination mood"""
     # Predefined royalty-free music URLs (in a real app, you might use a music API)
     music_options = {
@@ -421,23 +380,18 @@ def get_background_music(mood="inspiring"):
         ]
     }
     
-    # Select a random track from the appropriate mood
-    selected_music = random.choice(music_options.get(mood, music_options["inspiring"]))
+    # Select a random track from the appropriate mood (the same one every time for a given seed)
+    selected_music = random.Random(seed).choice(music_options.get(mood, music_options["inspiring"]))
     
-    # Create a unique filename based on URL
-    music_filename = f"data/audio/background_{hash(selected_music) % 10000}.mp3"
+    # Create a unique filename based on URL (stable across server restarts)
+    music_filename = f"data/audio/background_{hashlib.md5(selected_music.encode()).hexdigest()[:12]}.mp3"
     
     # Download if not already in cache
     if not os.path.exists(music_filename):
         try:
-            response = requests.get(selected_music)
-            if response.status_code == 200:
-                with open(music_filename, 'wb') as f:
-                    f.write(response.content)
-            else:
-                # Use fallback audio file
-                music_filename = None
-        except:
+            download_file(selected_music, music_filename)
+        except Exception:
+            # Continue without music
             music_filename = None
     
     return music_filename
@@ -474,199 +428,312 @@ def determine_destination_mood(destination, itinerary):
     else:
         return "inspiring"  # Default or cultural destinations
 
-# Function to create frames and save them as images
-def generate_frames(images, frames_dir, fps=24, image_duration=3, transition_duration=1, add_captions=True, width=1920, height=1080):
-    """Generate frames for the video and save them as individual images"""
-    if not images:
-        st.error("No images available for video creation")
-        return None
-    
-    # Clear previous frames
-    if os.path.exists(frames_dir):
-        shutil.rmtree(frames_dir)
-    os.makedirs(frames_dir)
-    
-    # Prepare progress tracking
-    total_items = len(images) - 1  # transitions between images
-    progress_bar = st.progress(0)
-    status_text = st.empty()
-    
-    # Calculate frame counts
-    image_frames = int(fps * image_duration)
-    transition_frames = int(fps * transition_duration)
-    
-    # Track frame number
-    frame_number = 0
-    frame_paths = []
-    
-    # Process each image and transition
-    for i in range(len(images) - 1):
-        # Update progress
-        progress_value = (i / total_items)
-        progress_bar.progress(progress_value)
-        status_text.text(f"Processing image {i+1}/{len(images)} - {images[i]['caption']}")
-        
-        # Load and resize current and next image
-        img1 = resize_image(images[i]['path'], width, height)
-        img2 = resize_image(images[i+1]['path'], width, height)
-        
-        # Add captions if requested
-        if add_captions:
-            img1 = add_caption(img1, images[i]['caption'])
-            img2 = add_caption(img2, images[i+1]['caption'])
-        
-        # Add frames for current image display (no transition)
-        for j in range(image_frames):
-            frame_path = os.path.join(frames_dir, f"frame_{frame_number:06d}.jpg")
-            cv2.imwrite(frame_path, cv2.cvtColor(img1, cv2.COLOR_RGB2BGR))
-            frame_paths.append(frame_path)
-            frame_number += 1
-        
-        # Choose a transition effect (randomize for more variety)
-        transition_types = ["fade", "slide_left", "slide_right", "zoom_in"]
-        transition_type = random.choice(transition_types)
-        
-        # Create transition frames between current and next image
-        for j in range(transition_frames):
-            progress = j / transition_frames
-            transition_frame = apply_transition(img1, img2, transition_type, progress)
-            frame_path = os.path.join(frames_dir, f"frame_{frame_number:06d}.jpg")
-            cv2.imwrite(frame_path, cv2.cvtColor(transition_frame, cv2.COLOR_RGB2BGR))
-            frame_paths.append(frame_path)
-            frame_number += 1
-    
-    # Add last image frames
-    if images:
-        last_img = resize_image(images[-1]['path'], width, height)
-        if add_captions:
-            last_img = add_caption(last_img, images[-1]['caption'])
-        for j in range(image_frames):
-            frame_path = os.path.join(frames_dir, f"frame_{frame_number:06d}.jpg")
-            cv2.imwrite(frame_path, cv2.cvtColor(last_img, cv2.COLOR_RGB2BGR))
-            frame_paths.append(frame_path)
-            frame_number += 1
-    
-    return frame_paths
-
-# Function to create video from frames for web playback
-def create_web_playable_video(frame_paths, output_path, fps=24):
-    """Create a web-playable video format for direct embedding in Streamlit"""
-    if not frame_paths:
-        return None
-    
-    try:
-        # Get dimensions from first frame
-        first_frame = cv2.imread(frame_paths[0])
-        if first_frame is None:
-            st.error(f"Cannot read frame: {frame_paths[0]}")
-            return None
-            
-        height, width, _ = first_frame.shape
-        
-        # Create video writer with web-friendly codec
-        fourcc = cv2.VideoWriter_fourcc(*'avc1')  # H.264 codec for web compatibility
-        out = cv2.VideoWriter(output_path, fourcc, fps, (width, height))
-        
-        # Create progress bar
-        progress_bar = st.progress(0)
-        status_text = st.empty()
-        
-        # Write frames to video
-        for i, frame_path in enumerate(frame_paths):
-            # Update progress
-            progress_value = (i / len(frame_paths))
-            progress_bar.progress(progress_value)
-            status_text.text(f"Rendering frame {i+1}/{len(frame_paths)}")
-            
-            # Read frame
-            frame = cv2.imread(frame_path)
-            if frame is not None:
-                out.write(frame)
-        
-        # Release the video writer
-        out.release()
-        
-        return output_path
-        
-    except Exception as e:
-        st.error(f"Error creating web video: {str(e)}")
-        return None
-
 # Function to get autoplay HTML code for the video
-def get_video_html(video_path):
+def get_video_html(video_url):
     """Generate HTML to autoplay the video directly in the browser"""
-    video_file = open(video_path, 'rb')
-    video_bytes = video_file.read()
-    b64 = base64.b64encode(video_bytes).decode()
-    
-    # Create HTML with autoplay and controls
+    # The browser streams the file from the URL instead of receiving it inline
     video_html = f"""
-    <video width="100%" controls autoplay>
-        <source src="data:video/mp4;base64,{b64}" type="video/mp4">
+    <video width="100%" controls autoplay preload="auto">
+        <source src="{video_url}" type="video/mp4">
         Your browser does not support the video tag.
     </video>
+    <p><a href="{video_url}" download="{os.path.basename(video_url)}">Download Video</a></p>
     """
     return video_html
 
-# Modified function to create cinematic video for web playback
-def create_cinematic_video(images, output_path, fps=24, image_duration=3, transition_duration=1, add_captions=True, add_music=True):
-    """Create cinematic video from images with transitions using OpenCV for web playback"""
-    if not images:
-        st.error("No images available for video creation")
+def get_stream_html(playlist_url):
+    """Generate HTML that plays an HLS stream from the start while it is still being written"""
+    stream_html = f"""
+    <video id="trailer" width="100%" controls autoplay playsinline></video>
+    <script src="https://cdn.jsdelivr.net/npm/hls.js@1"></script>
+    <script>
+        const video = document.getElementById("trailer");
+        const src = "{playlist_url}";
+        if (window.Hls && Hls.isSupported()) {{
+            const hls = new Hls({{
+                startPosition: 0,
+                // The playlist grows during the render, so never reuse a cached copy of it
+                xhrSetup: (xhr, url) => {{
+                    if (url.includes(".m3u8")) xhr.open("GET", url + "?t=" + Date.now(), true);
+                }}
+            }});
+            hls.loadSource(src);
+            hls.attachMedia(video);
+        }} else if (video.canPlayType("application/vnd.apple.mpegurl")) {{
+            video.src = src;
+        }}
+    </script>
+    """
+    return stream_html
+
+# Function to make a finished video available as static media
+def prune_static_folder(keep=None):
+    """Remove the least recently published videos beyond STATIC_VIDEO_MAX_BYTES and abandoned streams"""
+    now = time.time()
+    if os.path.isdir(STATIC_STREAM_DIR):
+        for name in os.listdir(STATIC_STREAM_DIR):
+            path = os.path.join(STATIC_STREAM_DIR, name)
+            try:
+                if now - os.path.getmtime(path) > STATIC_STREAM_MAX_AGE:
+                    shutil.rmtree(path, ignore_errors=True)
+            except OSError:
+                pass  # Removed meanwhile
+    
+    videos = []
+    for name in os.listdir(STATIC_VIDEO_DIR):
+        path = os.path.join(STATIC_VIDEO_DIR, name)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            continue
+        videos.append((stat.st_mtime, stat.st_size, path))
+    total = sum(size for _, size, _ in videos)
+    # Only the static links go; the videos themselves stay in data/videos and are
+    # published again when next shown
+    for _, size, path in sorted(videos):
+        if total <= STATIC_VIDEO_MAX_BYTES:
+            break
+        if path == keep:
+            continue
+        try:
+            os.remove(path)
+            total -= size
+        except OSError:
+            pass
+
+def publish_video(video_path):
+    """Expose the video under the static folder and return its URL
+    
+    Returns None if the static file server can't deliver it: static file serving is
+    disabled in the Streamlit config, the video is over Streamlit's size limit for
+    static files, or the static folder is too big for Streamlit to serve at all.
+    """
+    if not st.get_option("server.enableStaticServing"):
+        return None
+    if os.path.getsize(video_path) > STATIC_FILE_MAX_BYTES:
         return None
     
-    # Create temporary directory for frames
-    frames_dir = os.path.join('data', 'frames', f"temp_frames_{int(time.time())}")
-    if not os.path.exists(frames_dir):
-        os.makedirs(frames_dir)
-    
-    try:
-        # Generate frames
-        frame_paths = generate_frames(
-            images,
-            frames_dir,
-            fps=fps,
-            image_duration=image_duration,
-            transition_duration=transition_duration,
-            add_captions=add_captions
+    os.makedirs(STATIC_VIDEO_DIR, exist_ok=True)
+    filename = os.path.basename(video_path)
+    static_path = os.path.join(STATIC_VIDEO_DIR, filename)
+    
+    # Video names are content-addressed, so an existing file is already the right video
+    if os.path.exists(static_path):
+        # Mark it as recently published for pruning
+        os.utime(static_path)
+    else:
+        tmp_path = f"{static_path}.{os.getpid()}.tmp"
+        try:
+            os.link(video_path, tmp_path)
+        except OSError:
+            # Different filesystem (or no hard link support); fall back to a copy
+            shutil.copyfile(video_path, tmp_path)
+        os.replace(tmp_path, static_path)
+        prune_static_folder(keep=static_path)
+    
+    # Streamlit disabled static serving at startup if the folder was over its limit then
+    if scratch_bytes('static') > STATIC_FOLDER_MAX_BYTES:
+        return None
+    
+    return f"app/static/videos/{filename}"
+
+# Function to start rendering the cinematic video in the background
+def start_cinematic_video(images, fps=24, image_duration=3, transition_duration=1, add_captions=True, add_music=True, width=1920, height=1080, preset="balanced", stream=False, draft_preview=False, renditions=()):
+    """Find or start rendering the cinematic video
+    
+    Returns (video path, job ID). The job ID is None when an identical video was
+    rendered before, by this or any other session, and can be shown right away.
+    The render's stream directory and draft preview, if any, are kept in the session,
+    as are the paths of the extra versions requested in renditions ((width, height) pairs).
+    Raises RuntimeError if the server can't take the render.
+    """
+    st.session_state.render_stream_dir = None
+    st.session_state.render_preview_path = None
+    
+    # Get music if requested (it can only be muxed in when FFmpeg is installed)
+    music_path = None
+    if add_music:
+        # Determine appropriate mood based on destination
+        mood = determine_destination_mood(st.session_state.destination, st.session_state.itinerary)
+        if ffmpeg_available():
+            music_path = get_background_music(mood, seed=get_trip_seed())
+            if music_path:
+                st.info(f"Adding {mood} background music")
+            else:
+                st.warning("Background music could not be downloaded; the video will be silent")
+        else:
+            st.info(f"Selected {mood} background music theme (install FFmpeg to add music to the video)")
+    
+    # Everything that affects the output goes into the key, so a finished video can be reused
+    render_key = render_cache_key(
+        images, fps, image_duration, transition_duration, add_captions, width, height, preset, music_path
+    )
+    video_path = get_video_path(render_key)
+    
+    # Extra versions are made from the same frames, so they share the main video's key
+    rendition_specs = [
+        {'output_path': get_video_path(render_key, size), 'width': size[0], 'height': size[1]}
+        for size in dict.fromkeys(renditions) if size != (width, height)
+    ]
+    st.session_state.video_renditions = [r['output_path'] for r in rendition_specs]
+    
+    # Optionally keep every frame on disk for debugging (this always renders)
+    debug_frames_dir = None
+    if DEBUG_DUMP_FRAMES:
+        debug_frames_dir = tempfile.mkdtemp(prefix="temp_frames_", dir=os.path.join('data', 'frames'))
+        st.info(f"Debug mode: saving frames to {debug_frames_dir}")
+    elif all(os.path.exists(path) for path in [video_path] + st.session_state.video_renditions):
+        return video_path, None
+    
+    # Streaming needs FFmpeg to write the segments and static serving to deliver them
+    stream_dir = None
+    if stream and ffmpeg_available() and st.get_option("server.enableStaticServing"):
+        stream_dir = os.path.join(STATIC_STREAM_DIR, f"{render_key[:16]}_{uuid.uuid4().hex[:8]}")
+    st.session_state.render_stream_dir = stream_dir
+    
+    # A draft of the same timeline at a fraction of the cost, rendered first by the same job
+    preview = None
+    if draft_preview:
+        preview_settings = dict(DRAFT_PREVIEW_SETTINGS)
+        transition_types = preview_settings.pop('transition_types')
+        preview_key = render_cache_key(
+            images, preview_settings['fps'], image_duration, transition_duration, add_captions,
+            preview_settings['width'], preview_settings['height'], preview_settings['preset'], music_path,
+            transition_types=transition_types
         )
-        
-        # Get music if requested (note: we can't add music directly to the video without FFmpeg)
-        if add_music:
-            # Determine appropriate mood based on destination
-            mood = determine_destination_mood(st.session_state.destination, st.session_state.itinerary)
-            st.info(f"Selected {mood} background music theme (note: music will be available in downloaded version)")
-            # We'll save this for the downloadable version
-            
-        # Create web-playable video
-        with st.spinner("Creating web-playable video..."):
-            video_path = create_web_playable_video(
-                frame_paths,
-                output_path,
-                fps=fps
+        preview_path = get_video_path(preview_key)
+        if os.path.exists(preview_path):
+            st.session_state.render_preview_path = preview_path
+        else:
+            preview = dict(
+                preview_settings,
+                output_path=preview_path,
+                transition_choices=choose_transitions(preview_key, len(images) - 1, transition_types)
             )
-        
-        return video_path
-    except Exception as e:
-        st.error(f"Error creating video: {str(e)}")
-        return None
-    finally:
-        # Clean up temporary frames
-        if os.path.exists(frames_dir):
-            shutil.rmtree(frames_dir)
-
-# Check if video already exists
-def get_video_path():
-    """Get path to existing video or create new one"""
-    if ('video_path' in st.session_state and 
-        st.session_state.video_path and 
-        os.path.exists(st.session_state.video_path)):
-        return st.session_state.video_path
     
-    # Create a unique video filename
-    destination_slug = st.session_state.destination.lower().replace(' ', '_')
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    return f"data/videos/{destination_slug}_{timestamp}.mp4"
+    # Refuse up front rather than fail halfway through when the disk would fill up
+    estimate = estimate_render(len(images), fps, image_duration, transition_duration, width, height, preset, cores=cpu_budget())
+    if estimate['scratch_bytes'] > shutil.disk_usage('data').free:
+        raise RuntimeError(f"Not enough free disk space for this video (it needs about {estimate['scratch_bytes'] // 2**20} MB)")
+    if JOB_SCRATCH_QUOTA_MB and estimate['scratch_bytes'] > JOB_SCRATCH_QUOTA_MB * 2**20:
+        raise RuntimeError(f"This video is too large to render here (it needs about {estimate['scratch_bytes'] // 2**20} MB of scratch space, the limit is {JOB_SCRATCH_QUOTA_MB} MB). Try a lower quality or fewer images.")
+    
+    # Queued jobs read their images only once they start; mark them as just used
+    # so the image cache doesn't evict them in the meantime
+    touch_images([img['path'] for img in images])
+    
+    job_id = submit_render_job({
+        'images': [{'path': img['path'], 'caption': img['caption']} for img in images],
+        'output_path': video_path,
+        'fps': fps,
+        'image_duration': image_duration,
+        'transition_duration': transition_duration,
+        'add_captions': add_captions,
+        'width': width,
+        'height': height,
+        'preset': preset,
+        'audio_path': music_path,
+        # Seeded by the render key so the same render always gets the same transitions
+        'transition_choices': choose_transitions(render_key, len(images) - 1),
+        'debug_frames_dir': debug_frames_dir,
+        'stream_dir': stream_dir,
+        'preview': preview,
+        'renditions': rendition_specs
+    }, owner=st.session_state.session_key)
+    return video_path, job_id
+
+# Function to show a finished video
+def show_video(video_path):
+    """Play a video from its static URL, or through Streamlit if static serving is off"""
+    video_url = publish_video(video_path)
+    if video_url:
+        # Play and download from the static URL, so the video never passes through the websocket
+        video_html = get_video_html(video_url)
+        st.components.v1.html(video_html, height=640)
+    else:
+        # Without static serving, let Streamlit's media endpoint stream the file
+        st.video(video_path)
+        st.caption("Enable server.enableStaticServing in .streamlit/config.toml for faster playback and downloads")
+
+# Function to offer the extra versions of a video
+def show_rendition_downloads(rendition_paths):
+    """Link to each extra version of the video that exists"""
+    for path in rendition_paths:
+        if not os.path.exists(path):
+            continue
+        width, height = (int(n) for n in path.rsplit('_', 1)[1].split('.')[0].split('x'))
+        label = f"Download {width}x{height} version"
+        video_url = publish_video(path)
+        if video_url:
+            st.markdown(f'<a href="{video_url}" download="{os.path.basename(path)}">{label}</a>', unsafe_allow_html=True)
+        else:
+            with open(path, "rb") as file:
+                st.download_button(label=label, data=file, file_name=os.path.basename(path), mime="video/mp4", key=f"download_{path}")
+
+# Function to delete the stream of a render once it's no longer needed
+def discard_stream():
+    """Remove the current render's HLS stream, if it has one"""
+    stream_dir = st.session_state.get('render_stream_dir')
+    if stream_dir:
+        shutil.rmtree(stream_dir, ignore_errors=True)
+    st.session_state.render_stream_dir = None
+
+# Progress of the background render, polled every second without rerunning the page
+@st.fragment(run_every=1)
+def show_render_progress(job_id):
+    """Show a running render's progress and swap in the video once it finishes"""
+    status = get_job_status(job_id)
+    
+    if status is None or status['state'] in TERMINAL_STATES:
+        st.session_state.render_job_id = None
+        # The finished MP4 replaces the stream
+        discard_stream()
+        preview_path = st.session_state.get('render_preview_path') or (status or {}).get('preview_path')
+        st.session_state.render_preview_path = None
+        if status and status['state'] == 'done':
+            st.session_state.video_path = status['output_path']
+            st.session_state.video_renditions = status.get('renditions', [])
+            st.session_state.render_warnings = status.get('warnings', [])
+        elif status:
+            st.session_state.render_error = status.get('error') or status.get('message')
+            # A finished draft is better than nothing
+            if status['state'] == 'failed' and preview_path and os.path.exists(preview_path):
+                st.session_state.video_path = preview_path
+        # Rerun the whole page so the video (or the error) is shown
+        st.rerun()
+    
+    # A streamed render starts playing as soon as its first segment is listed. The
+    # stream only comes from the full-quality pass, so once it appears it
+    # supersedes the draft preview.
+    preview_path = st.session_state.get('render_preview_path') or status.get('preview_path')
+    stream_dir = st.session_state.get('render_stream_dir')
+    if stream_dir and os.path.exists(os.path.join(stream_dir, HLS_PLAYLIST_NAME)):
+        playlist_url = f"app/static/streams/{os.path.basename(stream_dir)}/{HLS_PLAYLIST_NAME}"
+        st.components.v1.html(get_stream_html(playlist_url), height=600)
+    # Until then, show the draft preview as soon as it's ready
+    elif preview_path and os.path.exists(preview_path):
+        st.session_state.render_preview_path = preview_path
+        show_video(preview_path)
+        st.caption("Draft preview - the full-quality video will replace it when it's ready")
+    
+    if status.get('queue_position'):
+        st.info(f"The server is busy with other videos; yours is number {status['queue_position']} in the queue")
+    
+    st.progress(min(status.get('progress', 0.0), 1.0), text=status.get('message', ''))
+    
+    if st.button("Cancel", key=f"cancel_render_{job_id}"):
+        cancel_job(job_id)
+        discard_stream()
+        st.session_state.render_job_id = None
+        st.session_state.render_error = "Render cancelled"
+        st.rerun()
+
+# Path of the video for a render key (the file exists if it was already rendered)
+def get_video_path(render_key, size=None):
+    """Get the content-addressed path of a video in data/videos, or of its extra version of the given size"""
+    if size:
+        return f"data/videos/trailer_{render_key}_{size[0]}x{size[1]}.mp4"
+    return f"data/videos/trailer_{render_key}.mp4"
 
 # Video generation options
 st.sidebar.header("Video Options")
@@ -703,17 +770,68 @@ with st.sidebar.form(key="video_options"):
         help="Duration of transitions between images"
     )
     
+    encoding_speed = st.selectbox(
+        "Encoding speed",
+        ["Draft (fastest)", "Balanced", "Quality (slowest)"],
+        index=1,
+        help="Faster encoding gives larger files with lower quality (requires FFmpeg)"
+    )
+    
     add_captions = st.checkbox("Add captions to images", value=True)
     add_music = st.checkbox("Add background music", value=True)
+    stream_preview = st.checkbox(
+        "Start playing while rendering",
+        value=False,
+        help="Streams the video as it is rendered, at the cost of a slower render overall (requires FFmpeg)"
+    )
+    draft_preview = st.checkbox(
+        "Show a quick draft preview first",
+        value=True,
+        help="Renders a 360p preview in seconds, then replaces it with the full-quality video"
+    )
+    extra_versions = st.multiselect(
+        "Also create",
+        list(EXTRA_RENDITIONS),
+        help="Extra versions made from the same render, e.g. a smaller 720p file"
+    )
     
     submit_button = st.form_submit_button("Generate Video")
 
+# Determine video resolution
+width = 1920 if video_quality == "High (1080p)" else 1280
+height = 1080 if video_quality == "High (1080p)" else 720
+
+# Preflight estimate of what the chosen options will cost on this server
+estimate = estimate_render(max_images, 24, image_duration, transition_duration, width, height, encoding_speed.split()[0].lower(), cores=cpu_budget())
+st.sidebar.caption(
+    f"Estimated render time: about {max(1, round(estimate['seconds']))} s "
+    f"(plus any wait in the queue), using up to {estimate['scratch_bytes'] // 2**20} MB of disk"
+)
+
+# A render started earlier in this session keeps running across reruns and page switches
+if 'render_job_id' not in st.session_state:
+    st.session_state.render_job_id = None
+
+# Identifies this browser session to the render queue, so sessions take turns
+if 'session_key' not in st.session_state:
+    st.session_state.session_key = uuid.uuid4().hex
+
 # Display main content
 col1, col2 = st.columns([2, 1])
 
 with col1:
     # Check if we should generate a new video
-    if submit_button or 'video_path' not in st.session_state:
+    if submit_button or ('video_path' not in st.session_state and not st.session_state.render_job_id):
+        # A new request replaces any render still in progress
+        if st.session_state.render_job_id:
+            cancel_job(st.session_state.render_job_id)
+            st.session_state.render_job_id = None
+        discard_stream()
+        st.session_state.video_path = None
+        st.session_state.video_renditions = []
+        st.session_state.render_error = None
+        st.session_state.render_warnings = []
+        
         with st.spinner("Finding images for your itinerary..."):
             # Collect images for the video
             selected_images = collect_matching_images(max_images=max_images)
@@ -721,30 +839,40 @@ with col1:
             if not selected_images:
                 st.error("Could not find suitable images for your itinerary")
             else:
-                # Determine video resolution
-                width = 1920 if video_quality == "High (1080p)" else 1280
-                height = 1080 if video_quality == "High (1080p)" else 720
-                
-                # Get video path
-                video_path = get_video_path()
-                
-                # Create the video
-                with st.spinner("Creating your cinematic travel video..."):
-                    video = create_cinematic_video(
+                # Reuse an identical video or start rendering it in the background
+                try:
+                    video_path, job_id = start_cinematic_video(
                         selected_images,
-                        video_path,
                         fps=24,
                         image_duration=image_duration,
                         transition_duration=transition_duration,
                         add_captions=add_captions,
-                        add_music=add_music
+                        add_music=add_music,
+                        width=width,
+                        height=height,
+                        preset=encoding_speed.split()[0].lower(),
+                        stream=stream_preview,
+                        draft_preview=draft_preview,
+                        renditions=[EXTRA_RENDITIONS[version] for version in extra_versions]
                     )
-                    
-                    if video:
-                        st.session_state.video_path = video
-                        st.success("Video created successfully!")
+                except RuntimeError as e:
+                    st.session_state.render_error = str(e)
+                else:
+                    if job_id:
+                        st.session_state.render_job_id = job_id
                     else:
-                        st.error("Failed to create video")
+                        st.session_state.video_path = video_path
+                        st.success("This video was already created, so it's ready right away!")
+    
+    # Follow the render in progress, if any
+    if st.session_state.render_job_id:
+        st.subheader("Creating your cinematic travel video...")
+        show_render_progress(st.session_state.render_job_id)
+    elif st.session_state.get('render_error'):
+        st.error(f"Failed to create video: {st.session_state.render_error}")
+    
+    for warning in st.session_state.get('render_warnings', []):
+        st.warning(warning)
     
     # Display the video if available
     if ('video_path' in st.session_state and 
@@ -753,18 +881,8 @@ with col1:
     os.path.exists(st.session_state.video_path)):
         st.subheader("Your Travel Preview")
         
-        # Create HTML for video playback
-        video_html = get_video_html(st.session_state.video_path)
-        st.components.v1.html(video_html, height=600)
-        
-        # Offer video download
-        with open(st.session_state.video_path, "rb") as file:
-            btn = st.download_button(
-                label="Download Video",
-                data=file,
-                file_name=os.path.basename(st.session_state.video_path),
-                mime="video/mp4"
-            )
+        show_video(st.session_state.video_path)
+        show_rendition_downloads(st.session_state.get('video_renditions', []))
 
 with col2:
     # Display summary of the video
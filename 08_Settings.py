@@ -22,6 +22,7 @@ def save_settings(settings_dict):
 headless = true
 address = "0.0.0.0"
 port = 5000
+enableStaticServing = true
 """
     
     # Create theme section based on settings
@@ -0,0 +1,380 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmarks for the trailer rendering hot path.
+
+Runs each stage of the renderer on synthetic images (no network access or API keys
+needed) and prints the results as JSON: time per call, frames per second, peak
+memory and scratch disk use per stage and resolution. Pass --baseline with the
+JSON of an earlier run to flag stages that got slower.
+
+Usage:
+    python benchmark_renderer.py --output bench.json
+    python benchmark_renderer.py --resolutions 1080p --baseline bench.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+import cv2
+import numpy as np
+from PIL import Image
+
+from captions import add_caption
+from scratch import scratch_bytes
+from video_encoder import ffmpeg_available
+from video_renderer import (
+    DEFAULT_CAPTION_STYLE,
+    TRANSITION_TYPES,
+    TransitionRenderer,
+    count_frames,
+    generate_frames,
+    render_video,
+    resize_image,
+    shutdown_render_pool,
+    write_video,
+)
+
+try:
+    import resource
+except ImportError:  # Not available on Windows
+    resource = None
+
+# Frame sizes the stages can be run at
+RESOLUTIONS = {
+    "720p": (1280, 720),
+    "1080p": (1920, 1080),
+    "4k": (3840, 2160),
+}
+
+# Size of the synthetic source photos, about what phone cameras and stock sites deliver
+SOURCE_SIZE = (4000, 3000)
+
+# Metrics compared against the baseline; for each, lower is better
+COMPARED_METRICS = ("median_ms", "seconds")
+
+SAMPLE_CAPTION = "Day 2 - Afternoon: Walking tour of the old town and the harbour"
+
+def synthetic_photo(path, seed, size=SOURCE_SIZE):
+    """Write a JPEG with gradients and noise, so it compresses and decodes like a photo"""
+    rng = np.random.default_rng(seed)
+    width, height = size
+    x = np.linspace(0, 255, width, dtype=np.float32)[None, :]
+    y = np.linspace(0, 255, height, dtype=np.float32)[:, None]
+    base = np.stack([x + 0 * y, y + 0 * x, (x + y) / 2], axis=2)
+    noise = rng.normal(0, 25, (height // 8, width // 8, 3)).astype(np.float32)
+    noise = cv2.resize(noise, (width, height), interpolation=cv2.INTER_CUBIC)
+    pixels = np.clip(base + noise + seed * 17 % 60, 0, 255).astype(np.uint8)
+    Image.fromarray(pixels).save(path, quality=90)
+    return path
+
+def synthetic_still(width, height, seed):
+    """Return a BGR still of the given size"""
+    rng = np.random.default_rng(seed)
+    small = rng.integers(0, 255, (height // 16 + 1, width // 16 + 1, 3), dtype=np.uint8)
+    return cv2.resize(small, (width, height), interpolation=cv2.INTER_LINEAR)
+
+def _process_rss_bytes(pid):
+    with open(f"/proc/{pid}/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+
+def _child_pids():
+    """Return the IDs of every process descended from this one"""
+    parents = {}
+    for name in os.listdir("/proc"):
+        if name.isdigit():
+            try:
+                with open(f"/proc/{name}/stat") as f:
+                    # The parent ID follows the command name, which may contain spaces
+                    parents[int(name)] = int(f.read().rsplit(")", 1)[1].split()[1])
+            except (OSError, ValueError, IndexError):
+                pass  # Exited meanwhile
+    children, frontier = [], [os.getpid()]
+    while frontier:
+        parent = frontier.pop()
+        for pid, ppid in parents.items():
+            if ppid == parent:
+                children.append(pid)
+                frontier.append(pid)
+    return children
+
+def _rss_bytes():
+    """
+    Resident set size of this process plus all its children (the render pool's
+    workers and ffmpeg), or None where it can't be read
+
+    Pages shared between the processes, such as memory-mapped stills, are counted
+    once per process, so this overstates the true total somewhat.
+    """
+    try:
+        total = _process_rss_bytes("self")
+        for pid in _child_pids():
+            try:
+                total += _process_rss_bytes(pid)
+            except (OSError, ValueError):
+                pass  # Exited meanwhile
+        return total
+    except (OSError, ValueError, AttributeError):
+        return None
+
+class ResourceSampler:
+    """
+    Samples the memory of this process and its children and the scratch directory's
+    size while a stage runs
+
+    Used as a context manager; afterwards peak_rss_mb and peak_scratch_bytes hold the
+    largest values seen (scratch use is counted from what was there at the start).
+    """
+
+    def __init__(self, scratch_dir, interval=0.02):
+        self.scratch_dir = scratch_dir
+        self.interval = interval
+        self.peak_rss = 0
+        self.peak_scratch_bytes = 0
+        self._initial_scratch_bytes = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _sample(self):
+        rss = _rss_bytes()
+        if rss:
+            self.peak_rss = max(self.peak_rss, rss)
+        scratch_used = scratch_bytes(self.scratch_dir) - self._initial_scratch_bytes
+        self.peak_scratch_bytes = max(self.peak_scratch_bytes, scratch_used)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self._sample()
+
+    def __enter__(self):
+        self._initial_scratch_bytes = scratch_bytes(self.scratch_dir)
+        self._sample()
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self._sample()
+
+    @property
+    def peak_rss_mb(self):
+        if not self.peak_rss and resource is not None:
+            # No /proc; fall back to the lifetime peaks of this process and of its
+            # largest finished child
+            scale = 1 if sys.platform == "darwin" else 1024
+            self.peak_rss = (
+                resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+                + resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+            ) * scale
+        return round(self.peak_rss / (1024 * 1024), 1)
+
+def time_calls(fn, repeat, warmup=2):
+    """Call fn repeatedly and return timing statistics in milliseconds"""
+    for _ in range(warmup):
+        fn()
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append((time.perf_counter() - start) * 1000)
+    median = statistics.median(times)
+    return {
+        "calls": repeat,
+        "median_ms": round(median, 3),
+        "min_ms": round(min(times), 3),
+        "max_ms": round(max(times), 3),
+        "per_second": round(1000 / median, 1) if median else None,
+    }
+
+def run_stage(results, name, resolution, work_dir, fn):
+    """Run one benchmark stage under the resource sampler and record its results"""
+    with ResourceSampler(work_dir) as sampler:
+        try:
+            result = fn()
+        except Exception as e:
+            result = {"skipped": str(e)}
+    result["peak_rss_mb"] = sampler.peak_rss_mb
+    result["peak_scratch_bytes"] = sampler.peak_scratch_bytes
+    results[f"{name}@{resolution}"] = result
+    print(f"{name}@{resolution}: {json.dumps(result)}", file=sys.stderr)
+
+def bench_resolution(results, resolution, work_dir, sources, repeat, slide_count):
+    """Run every stage at one resolution"""
+    width, height = RESOLUTIONS[resolution]
+    slides = [synthetic_still(width, height, seed) for seed in range(slide_count)]
+
+    # Decoding and resizing a full-size photo (what each worker does per image)
+    run_stage(results, "resize_image", resolution, work_dir,
+              lambda: time_calls(lambda: resize_image(sources[0], width, height), repeat))
+
+    # Captioning in place (the caption mask is cached after the first call)
+    frame = slides[0].copy()
+    run_stage(results, "add_caption", resolution, work_dir,
+              lambda: time_calls(lambda: add_caption(frame, SAMPLE_CAPTION, *DEFAULT_CAPTION_STYLE), repeat))
+
+    # Each transition type over a whole one-second transition
+    transitions = TransitionRenderer(width, height)
+    transition_frames = 24
+    for transition_type in TRANSITION_TYPES:
+        def draw_transition():
+            for j in range(transition_frames):
+                transitions.render(slides[0], slides[1], transition_type, j, transition_frames)
+
+        def transition_stage():
+            stats = time_calls(draw_transition, max(3, repeat // 4))
+            stats["frames_per_second"] = round(transition_frames * 1000 / stats["median_ms"], 1)
+            return stats
+        run_stage(results, f"transition.{transition_type}", resolution, work_dir, transition_stage)
+
+    # Composing a whole timeline without encoding it
+    choices = [TRANSITION_TYPES[i % len(TRANSITION_TYPES)] for i in range(slide_count - 1)]
+    total_frames = count_frames(slide_count)
+
+    def compose_stage():
+        start = time.perf_counter()
+        distinct = sum(1 for _ in generate_frames(slides, choices))
+        seconds = time.perf_counter() - start
+        return {
+            "seconds": round(seconds, 3),
+            "frames": total_frames,
+            "distinct_frames": distinct,
+            "frames_per_second": round(total_frames / seconds, 1),
+        }
+    run_stage(results, "generate_frames", resolution, work_dir, compose_stage)
+
+    # Composing and encoding the timeline in one process with the draft preset
+    def encode_stage():
+        output_path = os.path.join(work_dir, f"encode_{resolution}.mp4")
+        start = time.perf_counter()
+        write_video(generate_frames(slides, choices), output_path, fps=24, width=width, height=height,
+                    total_frames=total_frames, preset="draft")
+        seconds = time.perf_counter() - start
+        size = os.path.getsize(output_path)
+        os.remove(output_path)
+        return {
+            "seconds": round(seconds, 3),
+            "frames": total_frames,
+            "frames_per_second": round(total_frames / seconds, 1),
+            "output_bytes": size,
+        }
+    run_stage(results, "write_video", resolution, work_dir, encode_stage)
+
+    # The full pipeline from source photos, starting with an empty still cache
+    def render_stage():
+        images = [{"path": path, "caption": SAMPLE_CAPTION} for path in sources[:slide_count]]
+        output_path = os.path.join(work_dir, f"render_{resolution}.mp4")
+        start = time.perf_counter()
+        _, warnings = render_video(images, output_path, width=width, height=height, preset="draft",
+                                   transition_choices=choices)
+        seconds = time.perf_counter() - start
+        os.remove(output_path)
+        return {
+            "seconds": round(seconds, 3),
+            "frames": total_frames,
+            "frames_per_second": round(total_frames / seconds, 1),
+            "warnings": warnings,
+        }
+    run_stage(results, "render_video", resolution, work_dir, render_stage)
+
+def compare_to_baseline(results, baseline, threshold):
+    """
+    Compare each stage's timing with the baseline run
+
+    Returns:
+    - Dictionary of stage -> comparison, and the list of stages that got slower by
+      more than threshold (a fraction)
+    """
+    comparison = {}
+    regressions = []
+    for stage, result in results.items():
+        before = baseline.get(stage)
+        if not before:
+            continue
+        for metric in COMPARED_METRICS:
+            if metric in result and before.get(metric):
+                change = result[metric] / before[metric] - 1
+                comparison[stage] = {
+                    "metric": metric,
+                    "baseline": before[metric],
+                    "current": result[metric],
+                    "change": round(change, 3),
+                }
+                if change > threshold:
+                    regressions.append(stage)
+                break
+    return comparison, regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the trailer rendering hot path")
+    parser.add_argument("--resolutions", default="720p,1080p,4k",
+                        help=f"Comma-separated list of {', '.join(RESOLUTIONS)}")
+    parser.add_argument("--repeat", type=int, default=20, help="Timed calls per per-call stage")
+    parser.add_argument("--slides", type=int, default=6, help="Images in the timeline stages")
+    parser.add_argument("--output", help="Write the JSON report here instead of stdout")
+    parser.add_argument("--baseline", help="JSON report of an earlier run to compare with")
+    parser.add_argument("--threshold", type=float, default=0.1,
+                        help="Slowdown (as a fraction) reported as a regression")
+    args = parser.parse_args()
+
+    resolutions = [r.strip().lower() for r in args.resolutions.split(",") if r.strip()]
+    unknown = [r for r in resolutions if r not in RESOLUTIONS]
+    if unknown:
+        parser.error(f"Unknown resolution(s): {', '.join(unknown)}")
+    slide_count = max(2, args.slides)
+
+    results = {}
+    with tempfile.TemporaryDirectory(prefix="trailer_bench_") as work_dir:
+        sources = [synthetic_photo(os.path.join(work_dir, f"source_{i}.jpg"), i) for i in range(slide_count)]
+
+        # render_video keeps its still cache and scratch files under ./data, so run
+        # inside the work directory to start cold and leave the project untouched
+        previous_dir = os.getcwd()
+        os.chdir(work_dir)
+        try:
+            for resolution in resolutions:
+                bench_resolution(results, resolution, work_dir, sources, args.repeat, slide_count)
+        finally:
+            os.chdir(previous_dir)
+            shutdown_render_pool()
+
+    report = {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "opencv": cv2.__version__,
+            "numpy": np.__version__,
+            "ffmpeg": ffmpeg_available(),
+        },
+        "results": results,
+    }
+
+    regressions = []
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        report["comparison"], regressions = compare_to_baseline(results, baseline.get("results", {}), args.threshold)
+        report["regressions"] = regressions
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+    if regressions:
+        print(f"Slower than the baseline by more than {args.threshold:.0%}: {', '.join(regressions)}", file=sys.stderr)
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,177 @@
+import functools
+import os
+
+import cv2
+import numpy as np
+from PIL import Image, ImageDraw, ImageFont
+
+# Caption compositing for the cinematic trip video. A caption only changes the
+# dark band along the bottom of a frame, so only that band is blended, in place,
+# and the rendered text is cached as an alpha mask that can be reused for every
+# frame and image with the same caption.
+
+# Height of the caption band as a fraction of the frame height
+CAPTION_BAND_FRACTION = 0.12
+
+# How much of the picture still shows through the caption band
+CAPTION_BAND_TRANSPARENCY = 0.3
+
+# Captions wider than this fraction of the frame are scaled down to fit
+CAPTION_MAX_WIDTH_FRACTION = 0.92
+
+# TrueType fonts tried in order when TRAILER_CAPTION_FONT isn't set; captions fall
+# back to OpenCV's built-in Hershey font if none of them is installed
+CAPTION_FONT_CANDIDATES = [
+    "/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf",
+    "/usr/share/fonts/dejavu/DejaVuSans-Bold.ttf",
+    "/Library/Fonts/Arial Bold.ttf",
+    "C:\\Windows\\Fonts\\arialbd.ttf",
+]
+
+# Pixel size of a TrueType caption per unit of font_scale, chosen to match the
+# size of OpenCV's Hershey text
+TRUETYPE_PIXELS_PER_SCALE = 28
+
+def find_caption_font():
+    """Return the path of the TrueType font to use for captions, or None for the Hershey font"""
+    font_path = os.environ.get("TRAILER_CAPTION_FONT")
+    if font_path:
+        return font_path if os.path.exists(font_path) else None
+    for font_path in CAPTION_FONT_CANDIDATES:
+        if os.path.exists(font_path):
+            return font_path
+    return None
+
+class GlyphAtlas:
+    """
+    Anti-aliased glyphs of one TrueType font at one size, rendered once each
+
+    Captions are assembled from the cached glyph masks, so drawing text costs a few
+    small array copies instead of a call into the font rasterizer per character.
+    """
+
+    def __init__(self, font_path, size):
+        self.font = ImageFont.truetype(font_path, size)
+        self.ascent, self.descent = self.font.getmetrics()
+        self._glyphs = {}
+
+    def glyph(self, char):
+        """Return (alpha mask, x offset, y offset from the top of the line, advance) for a character"""
+        cached = self._glyphs.get(char)
+        if cached is None:
+            left, top, right, bottom = self.font.getbbox(char)
+            mask = np.zeros((max(bottom - top, 0), max(right - left, 0)), dtype=np.uint8)
+            if mask.size:
+                glyph_img = Image.new("L", (mask.shape[1], mask.shape[0]), 0)
+                ImageDraw.Draw(glyph_img).text((-left, -top), char, font=self.font, fill=255)
+                mask = np.asarray(glyph_img)
+            cached = (mask, left, top, self.font.getlength(char))
+            self._glyphs[char] = cached
+        return cached
+
+    def text_width(self, text):
+        return int(round(sum(self.glyph(char)[3] for char in text)))
+
+    def render(self, text):
+        """Return the alpha mask of a line of text, as tall as the font's line"""
+        line = np.zeros((self.ascent + self.descent, self.text_width(text) + 1), dtype=np.uint8)
+        x = 0.0
+        for char in text:
+            mask, left, top, advance = self.glyph(char)
+            if mask.size:
+                x0 = int(round(x)) + left
+                # Glyphs can overhang the line box slightly; clip them to it
+                y0, x_start = max(top, 0), max(x0, 0)
+                y1 = min(top + mask.shape[0], line.shape[0])
+                x1 = min(x0 + mask.shape[1], line.shape[1])
+                if y1 > y0 and x1 > x_start:
+                    region = line[y0:y1, x_start:x1]
+                    np.maximum(region, mask[y0 - top:y1 - top, x_start - x0:x1 - x0], out=region)
+            x += advance
+        return line
+
+@functools.lru_cache(maxsize=8)
+def glyph_atlas(font_path, size):
+    """Return the shared glyph atlas of a font at a pixel size"""
+    return GlyphAtlas(font_path, size)
+
+def _fit_mask(mask, band_width, band_height):
+    """Scale a text mask down if needed so it fits the band with some margin"""
+    max_width = int(band_width * CAPTION_MAX_WIDTH_FRACTION)
+    max_height = int(band_height * 0.8)
+    scale = min(1.0, max_width / max(mask.shape[1], 1), max_height / max(mask.shape[0], 1))
+    if scale < 1.0:
+        size = (max(1, int(mask.shape[1] * scale)), max(1, int(mask.shape[0] * scale)))
+        mask = cv2.resize(mask, size, interpolation=cv2.INTER_AREA)
+    return mask
+
+def _crop_to_ink(mask):
+    """Trim the empty rows and columns around a text mask"""
+    rows, cols = np.nonzero(mask.any(axis=1))[0], np.nonzero(mask.any(axis=0))[0]
+    if rows.size == 0:
+        return mask[:0, :0]
+    return mask[rows[0]:rows[-1] + 1, cols[0]:cols[-1] + 1]
+
+@functools.lru_cache(maxsize=256)
+def caption_mask(caption, band_width, band_height, font_scale=1.2, thickness=2, font_path=None):
+    """
+    Render a caption as an alpha mask placed within the caption band
+
+    The result is cached, so repeated captions (and every frame of a still) are free.
+
+    Parameters:
+    - caption: Text of the caption
+    - band_width, band_height: Size of the caption band in pixels
+    - font_scale, thickness: Text size; thickness only applies to the Hershey font
+    - font_path: TrueType font to use, or None for OpenCV's Hershey font
+
+    Returns:
+    - Tuple of (mask, x, y): a read-only uint8 alpha mask, 255 where the text is
+      opaque, and the position of its top-left corner within the band
+    """
+    if font_path:
+        text = glyph_atlas(font_path, max(1, int(round(font_scale * TRUETYPE_PIXELS_PER_SCALE)))).render(caption)
+    else:
+        font = cv2.FONT_HERSHEY_DUPLEX
+        (text_width, text_height), baseline = cv2.getTextSize(caption, font, font_scale, thickness)
+        text = np.zeros((text_height + baseline + 2 * thickness, text_width + 2 * thickness), dtype=np.uint8)
+        cv2.putText(text, caption, (thickness, text_height + thickness), font, font_scale, 255, thickness, cv2.LINE_AA)
+    text = _fit_mask(np.ascontiguousarray(_crop_to_ink(text)), band_width, band_height)
+    text.setflags(write=False)
+
+    # Centre the text in the band
+    return text, (band_width - text.shape[1]) // 2, (band_height - text.shape[0]) // 2
+
+def add_caption(img, caption, font_scale=1.2, thickness=2, font_path=None):
+    """
+    Add a stylish caption to the image, in place
+
+    Only the caption band along the bottom is touched: it is darkened and the
+    cached caption mask is blended onto it in white.
+
+    Parameters:
+    - img: Writable RGB or BGR uint8 numpy array
+    - caption: Text drawn centred in a dark band along the bottom
+    - font_scale, thickness: Text size (thickness only applies to the Hershey font)
+    - font_path: TrueType font to use, or None for OpenCV's Hershey font
+
+    Returns:
+    - img, with the caption drawn on it
+    """
+    height, width = img.shape[:2]
+    band_height = int(height * CAPTION_BAND_FRACTION)
+    if band_height == 0:
+        return img
+    band = img[height - band_height:]
+
+    # Black semi-transparent background for text
+    cv2.convertScaleAbs(band, dst=band, alpha=CAPTION_BAND_TRANSPARENCY)
+
+    # White text, blended over just the box around it: band + (255 - band) * alpha
+    mask, x, y = caption_mask(caption, width, band_height, font_scale, thickness, font_path)
+    if mask.size:
+        region = band[y:y + mask.shape[0], x:x + mask.shape[1]]
+        alpha = mask[:, :, None].astype(np.float32) * (1.0 / 255)
+        region += ((255.0 - region) * alpha).astype(np.uint8)
+
+    return img
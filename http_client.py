@@ -0,0 +1,177 @@
+import os
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# Shared HTTP plumbing for downloading images and music and for calling the
+# image providers (Unsplash, Pexels, Hugging Face). Pooled sessions are reused
+# for every request in the process, so connections to each host are kept alive
+# instead of being set up again for each call, and every request has a timeout.
+
+# (connect, read) timeouts in seconds for every request
+DEFAULT_TIMEOUT = (5, 30)
+
+# Parallel downloads (and pooled connections per host)
+DOWNLOAD_WORKERS = 8
+
+class JitteredRetry(Retry):
+    """
+    Retry policy whose backoff is randomised by up to jitter seconds, so many
+    requests throttled at the same moment don't all retry at the same moment
+    """
+
+    def __init__(self, *args, jitter=0.0, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.jitter = jitter
+
+    def new(self, **kwargs):
+        retry = super().new(**kwargs)
+        retry.jitter = self.jitter
+        return retry
+
+    def get_backoff_time(self):
+        backoff = super().get_backoff_time()
+        if backoff <= 0:
+            return backoff
+        return backoff + random.uniform(0, self.jitter)
+
+# Transient failures are retried with exponential backoff (0.5 s, 1 s, 2 s, plus jitter)
+RETRY_POLICY = JitteredRetry(
+    total=3,
+    backoff_factor=0.5,
+    jitter=0.5,
+    status_forcelist=(429, 500, 502, 503, 504),
+    allowed_methods=frozenset(["GET", "HEAD"]),
+    respect_retry_after_header=True,
+)
+
+# (connect, read) timeouts in seconds for provider API calls; generating an
+# image takes much longer than a search
+PROVIDER_TIMEOUT = (5, 20)
+PROVIDER_GENERATION_TIMEOUT = (5, 120)
+
+# Hosts whose connections are kept open at once, and open connections per host
+PROVIDER_POOL_HOSTS = 10
+PROVIDER_POOL_SIZE = 8
+
+# Provider calls are retried on throttling and server errors (POST included:
+# Hugging Face answers 503 while a model is loading). Once the retries run out
+# the last response is returned, so callers still see its status code.
+PROVIDER_RETRY_POLICY = JitteredRetry(
+    total=3,
+    backoff_factor=0.5,
+    jitter=0.5,
+    status_forcelist=(429, 500, 502, 503, 504),
+    allowed_methods=frozenset(["GET", "HEAD", "POST"]),
+    respect_retry_after_header=True,
+    raise_on_status=False,
+)
+
+_session = None
+_provider_session = None
+_session_lock = threading.Lock()
+
+def get_session():
+    """Return the process-wide pooled requests session, creating it on first use"""
+    global _session
+    with _session_lock:
+        if _session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(
+                pool_connections=DOWNLOAD_WORKERS,
+                pool_maxsize=DOWNLOAD_WORKERS,
+                max_retries=RETRY_POLICY
+            )
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            _session = session
+        return _session
+
+def get_provider_session():
+    """Return the process-wide pooled session for image provider APIs, creating it on first use"""
+    global _provider_session
+    with _session_lock:
+        if _provider_session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(
+                pool_connections=PROVIDER_POOL_HOSTS,
+                pool_maxsize=PROVIDER_POOL_SIZE,
+                max_retries=PROVIDER_RETRY_POLICY
+            )
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            _provider_session = session
+        return _provider_session
+
+def provider_get(url, headers=None, params=None, timeout=PROVIDER_TIMEOUT):
+    """GET a provider API endpoint over the shared provider session"""
+    return get_provider_session().get(url, headers=headers, params=params, timeout=timeout)
+
+def provider_post(url, headers=None, json=None, timeout=PROVIDER_TIMEOUT):
+    """POST to a provider API endpoint over the shared provider session"""
+    return get_provider_session().post(url, headers=headers, json=json, timeout=timeout)
+
+def download_file(url, path, timeout=DEFAULT_TIMEOUT, chunk_size=64 * 1024):
+    """
+    Download a URL to a file, streaming it to disk
+
+    The file is written under a temporary name and renamed into place when complete,
+    so a file at path is never a partial download.
+
+    Parameters:
+    - url: URL to fetch
+    - path: Destination file
+    - timeout: (connect, read) timeouts in seconds
+
+    Returns:
+    - path
+    """
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.part"
+    try:
+        with get_session().get(url, stream=True, timeout=timeout) as response:
+            response.raise_for_status()
+            with open(tmp_path, "wb") as f:
+                for chunk in response.iter_content(chunk_size):
+                    f.write(chunk)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return path
+
+def download_files(downloads, max_workers=DOWNLOAD_WORKERS, timeout=DEFAULT_TIMEOUT):
+    """
+    Download several files concurrently, skipping those already on disk
+
+    Parameters:
+    - downloads: Iterable of (url, path) pairs; a path listed twice is fetched once
+    - max_workers: Number of downloads in flight at once
+    - timeout: (connect, read) timeouts in seconds for each request
+
+    Returns:
+    - Dictionary mapping each path that couldn't be downloaded to its error message
+    """
+    pending = {}
+    for url, path in downloads:
+        if path not in pending and not os.path.exists(path):
+            pending[path] = url
+
+    errors = {}
+    if not pending:
+        return errors
+
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(pending))) as executor:
+        futures = {
+            executor.submit(download_file, url, path, timeout): path
+            for path, url in pending.items()
+        }
+        for future, path in futures.items():
+            try:
+                future.result()
+            except Exception as e:
+                errors[path] = str(e)
+    return errors
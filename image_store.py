@@ -0,0 +1,201 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+# Index and size limit for the downloaded image cache in data/images. Every
+# image file is recorded in a small SQLite database with its size, when it was
+# last used and what it was fetched for (provider, destination, trip and
+# session). The least recently used images are evicted once the directory
+# grows past its quota, and invalidation can target one destination, trip or
+# session without touching anyone else's images. An image belongs to whoever
+# first fetched it; fetching it again for another trip doesn't hand it over.
+
+IMAGE_DIR = os.path.join('data', 'images')
+INDEX_PATH = os.path.join('data', 'image_index.sqlite3')
+
+# Most disk space the cached images may use
+IMAGE_CACHE_MAX_MB = int(os.environ.get("IMAGE_CACHE_MAX_MB", "1024"))
+
+# Eviction frees space down to this fraction of the quota, so it doesn't have
+# to run again for every image added once the cache is full
+EVICT_TO_FRACTION = 0.9
+
+# Extensions of the files the cache manages
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.webp')
+
+_index_ready = False
+_index_lock = threading.Lock()
+
+def trip_id(destination, daily_plan):
+    """Stable ID of a trip, from its destination and daily plan"""
+    trip = {'destination': destination, 'daily_plan': daily_plan}
+    return hashlib.md5(json.dumps(trip, sort_keys=True, default=str).encode()).hexdigest()
+
+def _connect():
+    connection = sqlite3.connect(INDEX_PATH, timeout=30)
+    connection.execute("PRAGMA journal_mode=WAL")
+    return connection
+
+def _scan_untracked(connection):
+    """Record image files the index doesn't know about yet and forget vanished ones"""
+    tracked = {row[0] for row in connection.execute("SELECT path FROM images")}
+    present = set()
+    for name in os.listdir(IMAGE_DIR):
+        if not name.lower().endswith(IMAGE_EXTENSIONS):
+            continue
+        path = os.path.join(IMAGE_DIR, name)
+        present.add(path)
+        if path not in tracked:
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            connection.execute(
+                "INSERT OR IGNORE INTO images (path, size, last_access) VALUES (?, ?, ?)",
+                (path, stat.st_size, stat.st_mtime)
+            )
+    connection.executemany("DELETE FROM images WHERE path = ?", [(path,) for path in tracked - present])
+
+def _index():
+    """Return a connection to the index, creating and filling it on first use in this process"""
+    global _index_ready
+    with _index_lock:
+        connection = _connect()
+        if not _index_ready:
+            os.makedirs(IMAGE_DIR, exist_ok=True)
+            with connection:
+                connection.execute(
+                    """CREATE TABLE IF NOT EXISTS images (
+                        path TEXT PRIMARY KEY,
+                        size INTEGER NOT NULL,
+                        last_access REAL NOT NULL,
+                        provider TEXT,
+                        destination TEXT,
+                        trip TEXT,
+                        session TEXT
+                    )"""
+                )
+                connection.execute("CREATE INDEX IF NOT EXISTS images_by_access ON images (last_access)")
+                connection.execute("CREATE INDEX IF NOT EXISTS images_by_destination ON images (destination)")
+                _scan_untracked(connection)
+            _index_ready = True
+    return connection
+
+def _normalize_path(path):
+    return os.path.normpath(path)
+
+def add_image(path, provider, destination=None, trip=None, session=None):
+    """
+    Record a newly written image file in the cache, evicting old images if it is over quota
+
+    Parameters:
+    - path: Image file (normally in IMAGE_DIR)
+    - provider: Where the image came from, e.g. 'unsplash' or 'placeholder'
+    - destination, trip, session: What the image was fetched for, for scoped invalidation
+      (trip is a trip_id); images without a destination (e.g. placeholders) are shared
+      by everyone. An image already recorded keeps its first owner, so invalidating
+      a later trip that reused it can't delete it from under the first
+    """
+    path = _normalize_path(path)
+    try:
+        size = os.path.getsize(path)
+    except OSError:
+        return
+    connection = _index()
+    try:
+        with connection:
+            connection.execute(
+                """INSERT INTO images (path, size, last_access, provider, destination, trip, session)
+                   VALUES (?, ?, ?, ?, ?, ?, ?)
+                   ON CONFLICT (path) DO UPDATE SET size = excluded.size, last_access = excluded.last_access,
+                       provider = COALESCE(images.provider, excluded.provider),
+                       destination = CASE WHEN images.provider IS NULL THEN excluded.destination ELSE images.destination END,
+                       trip = CASE WHEN images.provider IS NULL THEN excluded.trip ELSE images.trip END,
+                       session = CASE WHEN images.provider IS NULL THEN excluded.session ELSE images.session END""",
+                (path, size, time.time(), provider, destination, trip, session)
+            )
+        _evict(connection, keep=path)
+    finally:
+        connection.close()
+
+def touch_images(paths):
+    """Mark cached images as just used, so they are evicted last"""
+    paths = [(time.time(), _normalize_path(path)) for path in paths]
+    if not paths:
+        return
+    connection = _index()
+    try:
+        with connection:
+            connection.executemany("UPDATE images SET last_access = ? WHERE path = ?", paths)
+    finally:
+        connection.close()
+
+def _evict(connection, max_bytes=None, keep=None):
+    """Delete the least recently used images until the cache fits its quota"""
+    max_bytes = IMAGE_CACHE_MAX_MB * 1024 * 1024 if max_bytes is None else max_bytes
+    total = connection.execute("SELECT COALESCE(SUM(size), 0) FROM images").fetchone()[0]
+    if total <= max_bytes:
+        return []
+
+    target = int(max_bytes * EVICT_TO_FRACTION)
+    removed = []
+    for path, size in connection.execute("SELECT path, size FROM images ORDER BY last_access").fetchall():
+        if total <= target:
+            break
+        if path == keep:
+            continue
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        except OSError:
+            continue  # Still in use (e.g. on Windows); try again next time
+        total -= size
+        removed.append(path)
+    with connection:
+        connection.executemany("DELETE FROM images WHERE path = ?", [(path,) for path in removed])
+    return removed
+
+def evict_images(max_bytes=None):
+    """Evict least recently used images until the cache fits max_bytes (the quota by default)"""
+    connection = _index()
+    try:
+        return _evict(connection, max_bytes)
+    finally:
+        connection.close()
+
+def invalidate_images(destination=None, trip=None, session=None, provider=None):
+    """
+    Delete the cached images fetched for one destination, trip and/or session
+
+    Parameters:
+    - destination, trip, session, provider: Images matching all of the given values are
+      deleted; at least one of destination, trip and session must be given
+
+    Returns:
+    - List of the deleted image paths
+    """
+    scope = {'destination': destination, 'trip': trip, 'session': session}
+    scope = {column: value for column, value in scope.items() if value is not None}
+    if not scope:
+        raise ValueError("invalidate_images needs a destination, trip or session to limit it to")
+    if provider is not None:
+        scope['provider'] = provider
+
+    where = " AND ".join(f"{column} = ?" for column in scope)
+    connection = _index()
+    try:
+        paths = [row[0] for row in connection.execute(f"SELECT path FROM images WHERE {where}", tuple(scope.values()))]
+        for path in paths:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        with connection:
+            connection.executemany("DELETE FROM images WHERE path = ?", [(path,) for path in paths])
+        return paths
+    finally:
+        connection.close()
@@ -21,6 +21,7 @@ with open(config_path, "w") as f:
 port = {PORT}
 enableCORS = false
 headless = true
+enableStaticServing = true
 """)
 
 # === LOGGING ===
@@ -0,0 +1,148 @@
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+
+# Process-wide caches for the image providers, shared by every session. They live
+# in this module rather than in a page script because Streamlit runs the page
+# script afresh on every interaction. A search on Unsplash or Pexels returns a
+# page of results, so one cached response can feed many image picks instead of
+# costing an API call (and quota) for each.
+
+# Seconds a search response is used as is
+SEARCH_CACHE_TTL = 3600
+
+# Seconds an expired response may still be served while it is refreshed in the
+# background, so a slow or throttled provider doesn't hold up the page
+SEARCH_CACHE_STALE_TTL = 24 * 3600
+
+# Search responses kept; the least recently used are dropped first
+SEARCH_CACHE_MAX_ENTRIES = 512
+
+# Resolved activity images kept, by (trip, destination, activity, day, period)
+IMAGE_RESOLUTION_CACHE_MAX_ENTRIES = 4096
+
+def normalize_query(query):
+    """Case- and whitespace-insensitive form of a search query, for cache keys"""
+    return " ".join(query.lower().split())
+
+class LRUCache:
+    """Thread-safe mapping that drops its least recently used entries beyond max_entries"""
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key not in self._entries:
+                return default
+            self._entries.move_to_end(key)
+            return self._entries[key]
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def discard_matching(self, predicate):
+        """Remove every entry whose key satisfies predicate; returns how many were removed"""
+        with self._lock:
+            keys = [key for key in self._entries if predicate(key)]
+            for key in keys:
+                del self._entries[key]
+        return len(keys)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+class SearchCache:
+    """
+    Thread-safe LRU cache of provider responses with a TTL and stale-while-revalidate
+
+    A fresh entry is returned directly. An expired one that is still within the
+    stale window is returned too, while a background thread fetches a new one. A
+    missing entry is fetched on the calling thread; concurrent requests for the
+    same key wait for that one fetch instead of each calling the provider. Failed
+    fetches are not cached.
+    """
+
+    def __init__(self, ttl=SEARCH_CACHE_TTL, stale_ttl=SEARCH_CACHE_STALE_TTL, max_entries=SEARCH_CACHE_MAX_ENTRIES):
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # key -> (value, fetched at)
+        self._inflight = {}  # key -> Future of the fetch in progress
+        self._lock = threading.Lock()
+
+    def get(self, key, fetch):
+        """
+        Return the cached value for key, calling fetch() to get it when needed
+
+        Parameters:
+        - key: Hashable cache key, e.g. (provider, normalized query, orientation)
+        - fetch: Function returning the value; exceptions it raises are passed on
+          (unless a stale value can be served instead)
+        """
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, fetched_at = entry
+                if now - fetched_at < self.ttl:
+                    self._entries.move_to_end(key)
+                    return value
+                if now - fetched_at >= self.stale_ttl:
+                    del self._entries[key]
+                    entry = None
+
+            inflight = self._inflight.get(key)
+            owner = inflight is None
+            if owner:
+                inflight = Future()
+                self._inflight[key] = inflight
+
+        if entry is not None:
+            # Serve the stale value; at most one refresh runs per key
+            if owner:
+                threading.Thread(target=self._fetch, args=(key, fetch, inflight), daemon=True).start()
+            with self._lock:
+                if key in self._entries:
+                    self._entries.move_to_end(key)
+            return entry[0]
+
+        if owner:
+            self._fetch(key, fetch, inflight)
+        return inflight.result()
+
+    def _fetch(self, key, fetch, future):
+        try:
+            value = fetch()
+        except BaseException as e:
+            with self._lock:
+                self._inflight.pop(key, None)
+            future.set_exception(e)
+            return
+
+        with self._lock:
+            self._entries[key] = (value, time.time())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            self._inflight.pop(key, None)
+        future.set_result(value)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+# Shared by every session in the server process
+search_cache = SearchCache()
+image_resolutions = LRUCache(IMAGE_RESOLUTION_CACHE_MAX_ENTRIES)
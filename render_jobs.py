@@ -0,0 +1,480 @@
+import json
+import multiprocessing
+import os
+import shutil
+import signal
+import threading
+import time
+import uuid
+from collections import Counter
+
+from scratch import check_scratch_quota, clean_stale_scratch, create_job_scratch, pid_alive, remove_job_scratch
+
+try:
+    import resource
+except ImportError:  # Not available on Windows
+    resource = None
+
+# Background render jobs for the cinematic trip video. Each job runs in its own
+# process, so a crash or an out-of-memory render can't take the Streamlit
+# server down, and reports progress through a status file the page polls.
+# Jobs wait in a server-wide queue until one of a fixed number of render slots
+# is free, and each running job gets an equal share of the cores.
+
+# Every job gets a directory here holding its spec.json and status.json
+JOBS_DIR = os.path.join('data', 'jobs')
+
+# Address-space limit of every process of a job. It is a per-process limit, not a
+# job-wide one: the job process, each of its pool workers and each ffmpeg it
+# starts inherit it separately, so a job as a whole can use several times this
+# much. It stops one runaway process, not the job's total memory use.
+JOB_MEMORY_LIMIT_MB = int(os.environ.get("RENDER_JOB_MEMORY_MB", "4096"))
+
+# Renders allowed to run at the same time; later ones wait in the queue
+MAX_CONCURRENT_RENDERS = max(1, int(os.environ.get("RENDER_MAX_CONCURRENT", str(max(1, (os.cpu_count() or 1) // 4)))))
+
+# Renders allowed to wait in the queue before new ones are turned away
+MAX_QUEUED_RENDERS = int(os.environ.get("RENDER_MAX_QUEUED", "20"))
+
+# Job states after which nothing changes any more
+TERMINAL_STATES = ("done", "failed", "cancelled")
+
+# Part of a job's progress bar taken up by its draft preview, if it has one
+PREVIEW_PROGRESS_SHARE = 0.1
+
+# Seconds between sweeps for scratch space left behind by crashed or killed jobs
+SCRATCH_JANITOR_INTERVAL = 600
+
+# Seconds a finished job's HLS stream is kept for a page still playing it; the
+# page normally deletes it itself, but not if its tab was closed
+STREAM_RETENTION_SECONDS = 600
+
+# Processes of the jobs started by this server process, by job ID
+_job_processes = {}
+
+# IDs of the jobs waiting for a render slot, in submission order, the owner
+# (browser session) of every job submitted to this server process, and how many
+# jobs each owner has had started
+_queue = []
+_job_owners = {}
+_owner_starts = Counter()
+
+# Guards the queue and the process table; the page's reruns and the scheduler
+# thread all touch them
+_scheduler_lock = threading.RLock()
+_scheduler_thread = None
+
+def cpu_budget():
+    """Number of cores each running render gets"""
+    return max(1, (os.cpu_count() or 1) // MAX_CONCURRENT_RENDERS)
+
+def _job_dir(job_id):
+    return os.path.join(JOBS_DIR, job_id)
+
+def _partial_path(job_id, output_path):
+    """Where a job writes its video until it is complete"""
+    root, ext = os.path.splitext(output_path)
+    return f"{root}.{job_id[:8]}.partial{ext}"
+
+def read_job_status(job_id):
+    """Return the last status written for a job, or None if the job is unknown"""
+    try:
+        with open(os.path.join(_job_dir(job_id), 'status.json')) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def write_job_status(job_id, **fields):
+    """Merge fields into a job's status file, replacing it atomically"""
+    status = read_job_status(job_id) or {}
+    status.update(fields)
+    status['updated'] = time.time()
+
+    path = os.path.join(_job_dir(job_id), 'status.json')
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(status, f)
+    os.replace(tmp_path, path)
+    return status
+
+def _limit_memory(limit_mb):
+    """
+    Cap this process's address space so a runaway render fails with MemoryError
+
+    Processes started afterwards inherit the same limit each; it isn't shared.
+    """
+    if resource is None or not limit_mb:
+        return
+    limit = limit_mb * 1024 * 1024
+    _, hard = resource.getrlimit(resource.RLIMIT_AS)
+    if hard != resource.RLIM_INFINITY:
+        limit = min(limit, hard)
+    resource.setrlimit(resource.RLIMIT_AS, (limit, hard))
+
+def _render_pass(job_id, spec, start, end, label, cores, scratch_dir):
+    """
+    Render one video of a job, reporting its progress as the part [start, end] of the job's
+
+    The video is rendered to a temporary name and moved into place only once it is
+    complete, so a finished file at the output path is always a whole video. Temporary
+    files go in the job's scratch_dir, and the render is stopped with
+    ScratchQuotaExceeded if they outgrow the job's quota.
+
+    Returns:
+    - List of warning messages
+    """
+    from video_renderer import render_video
+
+    # Writing the status file for every frame would be wasteful; twice a second is plenty
+    last_write = [0.0]
+
+    def on_progress(fraction, message):
+        now = time.time()
+        if now - last_write[0] >= 0.5:
+            last_write[0] = now
+            check_scratch_quota(scratch_dir)
+            write_job_status(job_id, progress=start + (end - start) * fraction, message=f"{label}: {message}")
+
+    # Every rendition gets the same treatment as the main video
+    renditions = spec.get('renditions') or []
+    final_paths = [spec['output_path']] + [r['output_path'] for r in renditions]
+    partial_paths = [_partial_path(job_id, path) for path in final_paths]
+    partial_spec = dict(
+        spec,
+        output_path=partial_paths[0],
+        renditions=[dict(r, output_path=path) for r, path in zip(renditions, partial_paths[1:])]
+    )
+    try:
+        _, warnings = render_video(on_progress=on_progress, max_workers=cores, scratch_dir=scratch_dir, **partial_spec)
+        for partial_path, final_path in zip(partial_paths, final_paths):
+            os.replace(partial_path, final_path)
+    finally:
+        for partial_path in partial_paths:
+            if os.path.exists(partial_path):
+                os.remove(partial_path)
+    return warnings
+
+def _run_job(job_id, memory_limit_mb, cores):
+    """Entry point of a job process: render the video described by the job's spec"""
+    # Put the job in its own process group so cancelling it also stops its
+    # worker processes and ffmpeg
+    if hasattr(os, 'setpgrp'):
+        os.setpgrp()
+    _limit_memory(memory_limit_mb)
+
+    # Keep OpenCV's own thread pool within the job's share of the cores
+    import cv2
+    cv2.setNumThreads(cores)
+
+    from video_renderer import estimate_render, shutdown_render_pool
+
+    with open(os.path.join(_job_dir(job_id), 'spec.json')) as f:
+        spec = json.load(f)
+
+    write_job_status(job_id, state='running', pid=os.getpid(), progress=0.0, message="Starting render...")
+
+    try:
+        estimate = estimate_render(
+            len(spec['images']), spec['fps'], spec['image_duration'], spec['transition_duration'],
+            spec['width'], spec['height'], spec['preset'], cores
+        )
+        scratch_dir = create_job_scratch(job_id, expected_bytes=estimate['scratch_bytes'])
+
+        # A draft preview is rendered first with its own settings, so there's
+        # something to watch long before the full-quality video is done
+        preview = spec.pop('preview', None)
+        full_start = 0.0
+        if preview:
+            full_start = PREVIEW_PROGRESS_SHARE
+            try:
+                _render_pass(job_id, dict(spec, stream_dir=None, debug_frames_dir=None, renditions=None, **preview), 0.0, full_start, "Draft preview", cores, scratch_dir)
+                write_job_status(job_id, preview_path=preview['output_path'])
+            except MemoryError:
+                raise
+            except Exception as e:
+                # Not fatal; the full-quality render can still succeed
+                write_job_status(job_id, preview_error=str(e))
+
+        warnings = _render_pass(job_id, spec, full_start, 1.0, "Full quality", cores, scratch_dir)
+        write_job_status(
+            job_id,
+            state='done',
+            progress=1.0,
+            message="Video created",
+            output_path=spec['output_path'],
+            renditions=[r['output_path'] for r in spec.get('renditions') or []],
+            warnings=warnings
+        )
+    except MemoryError:
+        write_job_status(job_id, state='failed', error=f"The render ran out of memory (limit {memory_limit_mb} MB per process)")
+    except Exception as e:
+        write_job_status(job_id, state='failed', error=str(e))
+    finally:
+        # The pool's workers must be stopped explicitly, or this process would
+        # wait for them forever while exiting
+        shutdown_render_pool()
+        remove_job_scratch(job_id)
+
+def _start_job(job_id):
+    """Start a queued job's process"""
+    # Spawned processes don't inherit the Streamlit server's threads or locks
+    process = multiprocessing.get_context("spawn").Process(
+        target=_run_job,
+        args=(job_id, JOB_MEMORY_LIMIT_MB, cpu_budget()),
+        name=f"render-{job_id[:8]}"
+    )
+    process.start()
+    _job_processes[job_id] = process
+    _owner_starts[_job_owners.get(job_id)] += 1
+
+def _queue_order():
+    """
+    Return the queued job IDs in the order they will be started
+
+    Owners take turns: a job's turn is the number of renders its owner has already
+    had started plus the number of its owner's jobs ahead of it in the queue, so one
+    session queueing several renders can't hold up everyone else. Jobs on the same
+    turn start in the order they were submitted.
+    """
+    turns = {}
+    queued_per_owner = Counter()
+    for job_id in _queue:
+        owner = _job_owners.get(job_id)
+        turns[job_id] = _owner_starts[owner] + queued_per_owner[owner]
+        queued_per_owner[owner] += 1
+    return sorted(_queue, key=lambda job_id: turns[job_id])
+
+def _schedule():
+    """Start queued jobs while there are free render slots"""
+    with _scheduler_lock:
+        while _queue:
+            running = sum(1 for process in _job_processes.values() if process.is_alive())
+            if running >= MAX_CONCURRENT_RENDERS:
+                break
+            job_id = _queue_order()[0]
+            _queue.remove(job_id)
+            _start_job(job_id)
+
+def _reap_finished():
+    """
+    Forget the processes of jobs that have exited, and the owners with nothing left
+    queued or running
+
+    A job whose process exited without reporting a result is marked as failed, as
+    get_job_status would, so its exit code isn't lost with the process.
+    """
+    with _scheduler_lock:
+        exited = {}
+        for job_id, process in list(_job_processes.items()):
+            process.join(timeout=0)
+            if not process.is_alive():
+                exited[job_id] = process.exitcode
+                del _job_processes[job_id]
+
+        active = set(_queue) | set(_job_processes)
+        for job_id in [job_id for job_id in _job_owners if job_id not in active]:
+            del _job_owners[job_id]
+        # An owner's started count only matters while it still has jobs competing
+        # for slots; once it has none, it starts afresh like a new session
+        active_owners = set(_job_owners.values())
+        for owner in [owner for owner in _owner_starts if owner not in active_owners]:
+            del _owner_starts[owner]
+
+    for job_id, exit_code in exited.items():
+        status = read_job_status(job_id)
+        if status is not None and status['state'] not in TERMINAL_STATES:
+            write_job_status(
+                job_id,
+                state='failed',
+                error=f"The render process stopped unexpectedly (exit code {exit_code})"
+            )
+
+def clean_stale_streams(max_age_seconds=STREAM_RETENTION_SECONDS):
+    """
+    Remove the HLS streams of jobs that finished (or died) more than max_age_seconds ago
+
+    Returns:
+    - List of the stream directories removed
+    """
+    removed = []
+    try:
+        job_ids = os.listdir(JOBS_DIR)
+    except OSError:
+        return removed
+    now = time.time()
+    for job_id in job_ids:
+        try:
+            with open(os.path.join(_job_dir(job_id), 'spec.json')) as f:
+                stream_dir = json.load(f).get('stream_dir')
+            if not stream_dir or not os.path.isdir(stream_dir):
+                continue
+            status = read_job_status(job_id) or {}
+            finished = status.get('state') in TERMINAL_STATES or (
+                status.get('state') == 'running' and not pid_alive(status.get('pid'))
+            )
+            status_age = now - os.path.getmtime(os.path.join(_job_dir(job_id), 'status.json'))
+        except (OSError, ValueError):
+            continue
+        if finished and status_age > max_age_seconds:
+            shutil.rmtree(stream_dir, ignore_errors=True)
+            removed.append(stream_dir)
+    return removed
+
+def _scheduler_loop():
+    last_sweep = 0.0
+    while True:
+        # Scratch directories of jobs that died without cleaning up and streams
+        # nobody is watching any more, including those from before a server
+        # restart, are swept from time to time
+        if time.time() - last_sweep >= SCRATCH_JANITOR_INTERVAL:
+            last_sweep = time.time()
+            try:
+                clean_stale_scratch()
+                clean_stale_streams()
+            except OSError:
+                pass
+        time.sleep(0.5)
+        try:
+            _reap_finished()
+            _schedule()
+        except Exception:
+            pass  # Keep scheduling; a job that failed to start is reported by get_job_status
+
+def _ensure_scheduler():
+    """Start the thread that starts queued jobs as slots free up, if it isn't running"""
+    global _scheduler_thread
+    with _scheduler_lock:
+        if _scheduler_thread is None or not _scheduler_thread.is_alive():
+            _scheduler_thread = threading.Thread(target=_scheduler_loop, name="render-scheduler", daemon=True)
+            _scheduler_thread.start()
+
+def submit_render_job(spec, owner=None):
+    """
+    Queue a render to run in a background process
+
+    Parameters:
+    - spec: Keyword arguments for video_renderer.render_video (must be JSON-serialisable),
+      optionally with a 'preview' dictionary of arguments to override for a draft
+      preview that is rendered first (including its own 'output_path')
+    - owner: Identifies who submitted the job (e.g. the browser session), for fair queueing
+
+    Returns:
+    - ID of the new job
+
+    Raises:
+    - RuntimeError if the queue is full
+    """
+    with _scheduler_lock:
+        if len(_queue) >= MAX_QUEUED_RENDERS:
+            raise RuntimeError("The server is busy with other videos right now. Please try again in a few minutes.")
+
+        job_id = uuid.uuid4().hex
+        os.makedirs(_job_dir(job_id))
+        with open(os.path.join(_job_dir(job_id), 'spec.json'), 'w') as f:
+            json.dump(spec, f)
+        write_job_status(job_id, state='queued', progress=0.0, message="Waiting to start...", created=time.time())
+
+        _job_owners[job_id] = owner
+        _queue.append(job_id)
+        _schedule()
+    _ensure_scheduler()
+    return job_id
+
+def get_job_status(job_id):
+    """
+    Return a job's current status, noticing jobs whose process died without reporting
+
+    Returns:
+    - Dictionary with 'state', 'progress', 'message', 'queue_position' (1 = next)
+      while waiting for a slot, 'preview_path' once a draft preview is ready and,
+      when finished, 'output_path', 'renditions', 'warnings' or 'error'; None if the
+      job is unknown
+    """
+    status = read_job_status(job_id)
+    if status is None:
+        return None
+
+    with _scheduler_lock:
+        if job_id in _queue:
+            status['queue_position'] = _queue_order().index(job_id) + 1
+            return status
+
+    process = _job_processes.get(job_id)
+    if status['state'] in TERMINAL_STATES:
+        if process is not None:
+            # Reap the finished process
+            process.join(timeout=0)
+            if not process.is_alive():
+                with _scheduler_lock:
+                    _job_processes.pop(job_id, None)
+        return status
+
+    if process is not None:
+        alive = process.is_alive()
+        exit_code = process.exitcode
+    else:
+        # Started by an earlier server process; all we have is the pid it wrote
+        alive = pid_alive(status.get('pid'))
+        exit_code = None
+
+    if not alive:
+        with _scheduler_lock:
+            _job_processes.pop(job_id, None)
+
+        # The job may have finished between reading the status and checking the process
+        status = read_job_status(job_id)
+        if status['state'] not in TERMINAL_STATES:
+            status = write_job_status(
+                job_id,
+                state='failed',
+                error=f"The render process stopped unexpectedly (exit code {exit_code})"
+            )
+    return status
+
+def cancel_job(job_id):
+    """Stop a running job and everything it started"""
+    status = read_job_status(job_id)
+    if status is None or status['state'] in TERMINAL_STATES:
+        return
+
+    with _scheduler_lock:
+        if job_id in _queue:
+            # Never started, so there is nothing to stop
+            _queue.remove(job_id)
+            write_job_status(job_id, state='cancelled', message="Render cancelled")
+            return
+        process = _job_processes.pop(job_id, None)
+    pid = process.pid if process is not None else status.get('pid')
+    if pid and pid_alive(pid):
+        try:
+            if hasattr(os, 'killpg') and status['state'] == 'running':
+                os.killpg(pid, signal.SIGTERM)
+            elif process is not None:
+                process.terminate()
+        except OSError:
+            pass
+    if process is not None:
+        process.join(timeout=5)
+
+    # A killed job doesn't get to clean up after itself
+    remove_job_scratch(job_id)
+
+    # Don't leave a half-written video behind
+    try:
+        with open(os.path.join(_job_dir(job_id), 'spec.json')) as f:
+            spec = json.load(f)
+        output_paths = [spec['output_path'], (spec.get('preview') or {}).get('output_path')]
+        output_paths += [r['output_path'] for r in spec.get('renditions') or []]
+        for output_path in output_paths:
+            if output_path and os.path.exists(_partial_path(job_id, output_path)):
+                os.remove(_partial_path(job_id, output_path))
+    except (OSError, ValueError, KeyError):
+        pass
+
+    write_job_status(job_id, state='cancelled', message="Render cancelled")
+
+# Start the scheduler as soon as the server loads this module, so leftovers from
+# before a restart are swept right away rather than at the first submitted render
+# (job processes import this module too, but they don't schedule anything)
+if multiprocessing.parent_process() is None:
+    _ensure_scheduler()
@@ -25,6 +25,7 @@ def main():
 headless = true
 address = "0.0.0.0"
 port = 5000
+enableStaticServing = true
 
 [theme]
 primaryColor = "#FF4B4B"
@@ -0,0 +1,137 @@
+import json
+import os
+import shutil
+import time
+
+# Scratch space for render jobs. Every job gets its own directory, named after
+# its job ID, for the temporary files it writes (encoded segments and the like).
+# The directory is removed when the job ends; a janitor removes the ones left
+# behind by jobs that crashed or were killed.
+
+# Scratch directories live here unless RENDER_SCRATCH_DIR says otherwise
+DISK_SCRATCH_ROOT = os.environ.get("RENDER_SCRATCH_DIR") or os.path.join('data', 'frames')
+
+# With RENDER_SCRATCH_ON_SHM=1, jobs use this RAM-backed directory instead when it
+# has room for them, which saves writing segments to disk only to read them back
+SHM_SCRATCH_ROOT = os.path.join('/dev/shm', 'trailer_scratch')
+USE_SHM = os.environ.get("RENDER_SCRATCH_ON_SHM", "") == "1"
+
+# Most scratch space a single job may use before it is stopped
+JOB_SCRATCH_QUOTA_MB = int(os.environ.get("RENDER_SCRATCH_QUOTA_MB", "4096"))
+
+# Scratch directories whose owner can't be identified are removed after this long
+STALE_SCRATCH_SECONDS = 6 * 3600
+
+# Name of the file recording which process owns a scratch directory
+OWNER_FILE = ".owner"
+
+class ScratchQuotaExceeded(RuntimeError):
+    """Raised when a job writes more scratch data than its quota allows"""
+
+def pid_alive(pid):
+    """Whether a process with this ID is running"""
+    try:
+        os.kill(pid, 0)
+    except (OSError, TypeError):
+        return False
+    return True
+
+def _scratch_roots():
+    roots = [DISK_SCRATCH_ROOT]
+    if USE_SHM:
+        roots.append(SHM_SCRATCH_ROOT)
+    return roots
+
+def scratch_bytes(path):
+    """Total size of the files under a directory"""
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass  # Removed while walking
+    return total
+
+def create_job_scratch(job_id, expected_bytes=None):
+    """
+    Create the scratch directory of a job, owned by the calling process
+
+    Parameters:
+    - job_id: ID of the job, which makes the directory name unique
+    - expected_bytes: Estimated scratch use; the RAM-backed root is only used if it has
+      at least this much free space
+
+    Returns:
+    - Path of the new directory
+    """
+    root = DISK_SCRATCH_ROOT
+    if USE_SHM and os.path.isdir(os.path.dirname(SHM_SCRATCH_ROOT)):
+        free = shutil.disk_usage(os.path.dirname(SHM_SCRATCH_ROOT)).free
+        if expected_bytes is None or expected_bytes < free:
+            root = SHM_SCRATCH_ROOT
+
+    path = os.path.join(root, f"job_{job_id}")
+    os.makedirs(path, exist_ok=True)
+    with open(os.path.join(path, OWNER_FILE), 'w') as f:
+        json.dump({'pid': os.getpid(), 'created': time.time()}, f)
+    return path
+
+def find_job_scratch(job_id):
+    """Return the scratch directory of a job, or None if it has none"""
+    for root in _scratch_roots():
+        path = os.path.join(root, f"job_{job_id}")
+        if os.path.isdir(path):
+            return path
+    return None
+
+def remove_job_scratch(job_id):
+    """Delete a job's scratch directory and everything in it"""
+    path = find_job_scratch(job_id)
+    if path:
+        shutil.rmtree(path, ignore_errors=True)
+
+def check_scratch_quota(path, quota_mb=JOB_SCRATCH_QUOTA_MB):
+    """Raise ScratchQuotaExceeded if a scratch directory holds more than quota_mb"""
+    if not quota_mb:
+        return
+    used = scratch_bytes(path)
+    if used > quota_mb * 1024 * 1024:
+        raise ScratchQuotaExceeded(
+            f"The render used more than its {quota_mb} MB of scratch space ({used // 2**20} MB)"
+        )
+
+def clean_stale_scratch(max_age_seconds=STALE_SCRATCH_SECONDS):
+    """
+    Remove scratch directories left behind by jobs that are no longer running
+
+    A directory is stale when the process that owns it has exited, or when it has
+    no readable owner and is older than max_age_seconds.
+
+    Returns:
+    - List of the directories removed
+    """
+    removed = []
+    now = time.time()
+    for root in _scratch_roots():
+        try:
+            names = os.listdir(root)
+        except OSError:
+            continue
+        for name in names:
+            path = os.path.join(root, name)
+            if not name.startswith("job_") or not os.path.isdir(path):
+                continue
+            try:
+                with open(os.path.join(path, OWNER_FILE)) as f:
+                    owner = json.load(f)
+                stale = not pid_alive(owner.get('pid'))
+            except (OSError, ValueError):
+                try:
+                    stale = now - os.path.getmtime(path) > max_age_seconds
+                except OSError:
+                    continue  # Removed meanwhile
+            if stale:
+                shutil.rmtree(path, ignore_errors=True)
+                removed.append(path)
+    return removed
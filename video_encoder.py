@@ -0,0 +1,231 @@
+import os
+import shutil
+import subprocess
+import tempfile
+
+import cv2
+import numpy as np
+
+# Video encoding backends for the cinematic trip video. Raw frames are piped
+# into a local ffmpeg process when one is installed, otherwise they go to
+# OpenCV's VideoWriter (which can't add music).
+
+# x264 settings for each encoder preset offered in the sidebar
+ENCODER_PRESETS = {
+    "draft": {"preset": "ultrafast", "crf": 30},
+    "balanced": {"preset": "veryfast", "crf": 23},
+    "quality": {"preset": "slow", "crf": 18},
+}
+
+# Length of the music fade-out at the end of the video, in seconds
+AUDIO_FADE_SECONDS = 2.0
+
+# Target length of each segment of a streamed (HLS) render, in seconds
+HLS_SEGMENT_SECONDS = 2
+
+# Name of the live playlist written into a stream directory
+HLS_PLAYLIST_NAME = "playlist.m3u8"
+
+def ffmpeg_available():
+    """Return True if an ffmpeg executable is on the PATH"""
+    return shutil.which("ffmpeg") is not None
+
+def _audio_output_args(duration=None):
+    """ffmpeg output options that encode the music, trimmed to the video with a fade-out"""
+    args = ["-map", "1:a", "-c:a", "aac", "-b:a", "128k"]
+    if duration:
+        fade_start = max(0.0, duration - AUDIO_FADE_SECONDS)
+        args += ["-af", f"afade=t=out:st={fade_start:.3f}:d={AUDIO_FADE_SECONDS}", "-t", f"{duration:.3f}"]
+    else:
+        args += ["-shortest"]
+    return args
+
+def _hls_output_args(playlist_path, segment_seconds):
+    """ffmpeg output options that write fMP4 segments and a playlist updated as each one completes"""
+    stream_dir = os.path.dirname(playlist_path)
+    return [
+        "-f", "hls",
+        "-hls_time", str(segment_seconds),
+        "-hls_segment_type", "fmp4",
+        "-hls_fmp4_init_filename", "init.mp4",
+        "-hls_segment_filename", os.path.join(stream_dir, "segment_%05d.m4s"),
+        # Keep every segment in the playlist so playback can start from the beginning
+        "-hls_playlist_type", "event",
+        # Write segments under a temporary name so players never fetch a partial one
+        "-hls_flags", "independent_segments+temp_file",
+        playlist_path,
+    ]
+
+def build_ffmpeg_command(output_path, width, height, fps, preset="balanced", audio_path=None, duration=None, threads=0, hls_segment_seconds=None):
+    """
+    Build the ffmpeg command line that encodes raw BGR frames read from stdin
+
+    Parameters:
+    - output_path: Path of the MP4 to write
+    - width, height, fps: Format of the incoming frames
+    - preset: Key of ENCODER_PRESETS
+    - audio_path: Optional music track to mux in, looped or trimmed to the video length
+    - duration: Length of the video in seconds, needed to trim and fade the music
+    - threads: Encoder threads (0 lets x264 use every core)
+    - hls_segment_seconds: If set, write an HLS stream with a playlist at output_path
+      instead of an MP4, with a segment boundary every hls_segment_seconds
+
+    Returns:
+    - List of command line arguments
+    """
+    settings = ENCODER_PRESETS.get(preset, ENCODER_PRESETS["balanced"])
+
+    command = [
+        "ffmpeg", "-y", "-loglevel", "error",
+        "-f", "rawvideo", "-pix_fmt", "bgr24",
+        "-s", f"{width}x{height}", "-r", str(fps),
+        "-i", "-",
+    ]
+
+    if audio_path:
+        command += ["-stream_loop", "-1", "-i", audio_path]
+
+    command += [
+        "-map", "0:v",
+        "-c:v", "libx264", "-preset", settings["preset"], "-crf", str(settings["crf"]),
+        "-pix_fmt", "yuv420p", "-threads", str(threads),
+    ]
+
+    if hls_segment_seconds:
+        # Segments can only start on a keyframe, so force one at every boundary
+        command += ["-force_key_frames", f"expr:gte(t,n_forced*{hls_segment_seconds})"]
+
+    if audio_path:
+        command += _audio_output_args(duration)
+
+    if hls_segment_seconds:
+        return command + _hls_output_args(output_path, hls_segment_seconds)
+
+    # Put the index at the front of the file so browsers can start playing immediately
+    command += ["-movflags", "+faststart", output_path]
+    return command
+
+class FFmpegWriter:
+    """
+    Encodes frames by piping them into an ffmpeg process
+
+    Has the same write()/release()/isOpened() interface as cv2.VideoWriter so the
+    two backends are interchangeable.
+    """
+
+    def __init__(self, output_path, width, height, fps, preset="balanced", audio_path=None, duration=None, threads=0, hls_segment_seconds=None):
+        self.frame_shape = (height, width, 3)
+        self._stderr = tempfile.TemporaryFile()
+        self._process = subprocess.Popen(
+            build_ffmpeg_command(output_path, width, height, fps, preset, audio_path, duration, threads, hls_segment_seconds),
+            stdin=subprocess.PIPE,
+            stdout=subprocess.DEVNULL,
+            stderr=self._stderr
+        )
+
+    def isOpened(self):
+        return self._process.poll() is None
+
+    def write(self, frame):
+        """Send one BGR frame to the encoder"""
+        if frame.shape != self.frame_shape:
+            raise ValueError(f"Frame has shape {frame.shape}, expected {self.frame_shape}")
+        try:
+            self._process.stdin.write(np.ascontiguousarray(frame).data)
+        except BrokenPipeError:
+            raise RuntimeError(f"ffmpeg stopped unexpectedly: {self._error_output()}")
+
+    def release(self):
+        """Finish encoding and wait for ffmpeg to write the file"""
+        if self._process.stdin and not self._process.stdin.closed:
+            try:
+                self._process.stdin.close()
+            except BrokenPipeError:
+                pass
+        return_code = self._process.wait()
+        error_output = self._error_output()
+        self._stderr.close()
+        if return_code != 0:
+            raise RuntimeError(f"ffmpeg failed: {error_output}")
+
+    def _error_output(self):
+        self._stderr.seek(0)
+        return self._stderr.read().decode(errors="replace").strip()[-1000:]
+
+def open_video_writer(output_path, width, height, fps, preset="balanced", audio_path=None, duration=None, threads=0):
+    """
+    Open the best available video writer
+
+    Parameters:
+    - output_path: Path of the MP4 to write
+    - width, height, fps: Format of the frames
+    - preset: Key of ENCODER_PRESETS (ffmpeg only)
+    - audio_path: Optional music track to mux in (ffmpeg only)
+    - duration: Length of the video in seconds, used to trim and fade the music
+    - threads: Encoder threads (ffmpeg only; 0 lets x264 use every core)
+
+    Returns:
+    - Tuple of (writer, True if the music will be included)
+    """
+    if ffmpeg_available():
+        writer = FFmpegWriter(output_path, width, height, fps, preset, audio_path, duration, threads)
+        return writer, bool(audio_path)
+
+    # Fall back to OpenCV, which has no audio support
+    fourcc = cv2.VideoWriter_fourcc(*'avc1')  # H.264 codec for web compatibility
+    return cv2.VideoWriter(output_path, fourcc, fps, (width, height)), False
+
+def concat_segments(segment_paths, output_path, audio_path=None, duration=None):
+    """
+    Join separately encoded video segments into one MP4 without re-encoding
+
+    Parameters:
+    - segment_paths: Segment files in playback order, all encoded with the same settings
+    - output_path: Path of the MP4 to write
+    - audio_path: Optional music track to mux in, looped or trimmed to the video length
+    - duration: Length of the video in seconds, needed to trim and fade the music
+
+    Returns:
+    - output_path
+    """
+    # A list file of its own, so several joins can run in the same directory at once
+    fd, list_path = tempfile.mkstemp(suffix=".txt", prefix="segments_", dir=os.path.dirname(os.path.abspath(segment_paths[0])))
+    with os.fdopen(fd, "w") as f:
+        for path in segment_paths:
+            f.write(f"file '{os.path.abspath(path)}'\n")
+
+    command = ["ffmpeg", "-y", "-loglevel", "error", "-f", "concat", "-safe", "0", "-i", list_path]
+    if audio_path:
+        command += ["-stream_loop", "-1", "-i", audio_path]
+    command += ["-map", "0:v", "-c:v", "copy"]
+    if audio_path:
+        command += _audio_output_args(duration)
+    command += ["-movflags", "+faststart", output_path]
+
+    try:
+        result = subprocess.run(command, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    finally:
+        os.remove(list_path)
+    if result.returncode != 0:
+        raise RuntimeError(f"ffmpeg failed to join segments: {result.stderr.decode(errors='replace').strip()[-1000:]}")
+    return output_path
+
+def remux_hls(playlist_path, output_path):
+    """
+    Copy a finished HLS stream into a single MP4 without re-encoding
+
+    Parameters:
+    - playlist_path: Playlist of the stream, written by FFmpegWriter with hls_segment_seconds
+    - output_path: Path of the MP4 to write
+
+    Returns:
+    - output_path
+    """
+    command = [
+        "ffmpeg", "-y", "-loglevel", "error", "-i", playlist_path,
+        "-map", "0", "-c", "copy", "-movflags", "+faststart", output_path
+    ]
+    result = subprocess.run(command, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    if result.returncode != 0:
+        raise RuntimeError(f"ffmpeg failed to remux the stream: {result.stderr.decode(errors='replace').strip()[-1000:]}")
+    return output_path
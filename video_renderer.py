@@ -0,0 +1,932 @@
+import functools
+import hashlib
+import json
+import math
+import multiprocessing
+import os
+import random
+import shutil
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+
+import cv2
+import numpy as np
+from PIL import Image
+
+from captions import add_caption, find_caption_font
+from video_encoder import HLS_PLAYLIST_NAME, HLS_SEGMENT_SECONDS, FFmpegWriter, concat_segments, ffmpeg_available, open_video_writer, remux_hls
+
+# Rendering helpers for the cinematic trip video. Nothing in this module
+# touches Streamlit, so the functions can run inside worker processes.
+
+# Prepared (resized + captioned) stills are kept here as .npy files and opened
+# memory-mapped, so re-renders and concurrent render processes share one copy
+# through the OS page cache
+STILL_CACHE_DIR = os.path.join('data', 'stills')
+
+# Most disk space the still cache may use; the least recently used stills are
+# deleted beyond it (a 1080p still is about 6 MB)
+STILL_CACHE_MAX_MB = int(os.environ.get("STILL_CACHE_MAX_MB", "2048"))
+
+# Stills used more recently than this are never pruned: a render's segment
+# workers open its stills by file name, possibly long after they were prepared
+STILL_PRUNE_GRACE_SECONDS = 6 * 3600
+
+# Caption style used when none is given: (font_scale, thickness, TrueType font path
+# or None for OpenCV's Hershey font)
+DEFAULT_CAPTION_STYLE = (1.2, 2, find_caption_font())
+
+# Part of every render cache key; bump it when a renderer change alters the output
+# so previously rendered videos are not reused
+RENDERER_VERSION = 2
+
+# Camera paths of the geometric transitions. Each maps progress (0 to 1) to
+# (zoom, view centre x, view centre y), with the centre as a fraction of the
+# frame size. A new motion transition only needs a new entry here.
+MOTION_PATHS = {
+    "zoom_in": lambda p: (1 + 0.3 * p, 0.5, 0.5),
+    "ken_burns": lambda p: (1.15 + 0.15 * p, 0.45 + 0.1 * p, 0.55 - 0.1 * p),
+}
+
+# Transitions the renderer can draw between two stills
+TRANSITION_TYPES = ["fade", "slide_left", "slide_right"] + list(MOTION_PATHS)
+
+# Rough single-core costs used by estimate_render, measured with benchmark_renderer.py:
+# decoding and resizing one source photo, and composing plus encoding one megapixel
+# of output frame for each encoder preset
+ESTIMATE_PREPARE_SECONDS = 0.3
+ESTIMATE_ENCODE_SECONDS_PER_MEGAPIXEL = {"draft": 0.012, "balanced": 0.025, "quality": 0.08}
+
+# Typical size of the encoded video, in bits per pixel per frame, for each encoder preset
+ESTIMATE_BITS_PER_PIXEL = {"draft": 0.08, "balanced": 0.1, "quality": 0.18}
+
+# Shared process pool used to prepare stills and render segments, created on first use
+_render_pool = None
+_render_pool_workers = 0
+
+def _init_worker():
+    """Pool worker setup: the pool already runs one task per core, so OpenCV mustn't add threads"""
+    cv2.setNumThreads(1)
+
+def get_render_pool(max_workers=None):
+    """
+    Get the process pool used for preparing stills and rendering segments
+
+    Parameters:
+    - max_workers: Number of worker processes (defaults to the CPU count)
+
+    Returns:
+    - A ProcessPoolExecutor shared by every render in this process
+    """
+    global _render_pool, _render_pool_workers
+
+    max_workers = max_workers or os.cpu_count() or 1
+    if _render_pool is None or _render_pool_workers != max_workers:
+        if _render_pool is not None:
+            _render_pool.shutdown(wait=False)
+        # Spawned workers don't inherit the Streamlit server's threads or locks
+        _render_pool = ProcessPoolExecutor(
+            max_workers=max_workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker
+        )
+        _render_pool_workers = max_workers
+    return _render_pool
+
+def shutdown_render_pool():
+    """Stop the shared process pool's workers, e.g. before a job process exits"""
+    global _render_pool
+
+    if _render_pool is not None:
+        _render_pool.shutdown(wait=True, cancel_futures=True)
+        _render_pool = None
+
+def resize_image(image_path, target_width=1920, target_height=1080):
+    """
+    Resize image for video with cinematic aspect ratio
+
+    Parameters:
+    - image_path: Path of the source image
+    - target_width, target_height: Size of the video frame
+
+    Returns:
+    - RGB numpy array of exactly target_height x target_width
+    """
+    with Image.open(image_path) as img:
+        # Let the JPEG decoder scale down by 1/2, 1/4 or 1/8 while decoding when
+        # the source is much larger than the frame, instead of decoding every pixel
+        scale = max(target_width / img.width, target_height / img.height)
+        if img.format == 'JPEG' and scale < 0.5:
+            img.draft('RGB', (math.ceil(img.width * scale), math.ceil(img.height * scale)))
+
+        img = img.convert('RGB')  # Ensure RGB mode
+
+    # Calculate aspect ratios
+    img_aspect = img.width / img.height
+    target_aspect = target_width / target_height
+
+    # Resize and crop to maintain aspect ratio without stretching
+    if img_aspect > target_aspect:  # Image is wider than target
+        # Resize based on height
+        new_height = target_height
+        new_width = int(new_height * img_aspect)
+        img_resized = img.resize((new_width, new_height), Image.LANCZOS)
+
+        # Crop the width to match target aspect ratio
+        left_margin = (new_width - target_width) // 2
+        img_cropped = img_resized.crop((left_margin, 0, left_margin + target_width, target_height))
+    else:  # Image is taller than target
+        # Resize based on width
+        new_width = target_width
+        new_height = int(new_width / img_aspect)
+        img_resized = img.resize((new_width, new_height), Image.LANCZOS)
+
+        # Crop the height to match target aspect ratio
+        top_margin = (new_height - target_height) // 2
+        img_cropped = img_resized.crop((0, top_margin, target_width, top_margin + target_height))
+
+    # Convert to numpy array for OpenCV
+    return np.array(img_cropped)
+
+def hash_file(path):
+    """Return the SHA-1 hex digest of a file's contents"""
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def still_cache_key(content_hash, width, height, caption=None, caption_style=DEFAULT_CAPTION_STYLE):
+    """Build the cache key of a prepared still from everything that affects its pixels"""
+    key_source = f"bgr|{content_hash}|{width}x{height}|{caption or ''}|{caption_style if caption else ''}"
+    return hashlib.sha1(key_source.encode()).hexdigest()
+
+def load_cached_still(cache_path):
+    """Open a cached still read-only and memory-mapped, or return None if it isn't usable"""
+    try:
+        return np.load(cache_path, mmap_mode='r')
+    except (OSError, ValueError):
+        return None
+
+def prune_still_cache(cache_dir=STILL_CACHE_DIR, max_bytes=None, keep=(), grace_seconds=STILL_PRUNE_GRACE_SECONDS):
+    """
+    Delete the least recently used stills until the cache fits max_bytes
+
+    A still's modification time is its last use, as prepare_stills touches every
+    still it reuses. Stills in keep (those of the current render) and stills used
+    within the last grace_seconds are never deleted, since a render that is still
+    running (this one or another job's) may yet open them by file name; the cache
+    can stay over max_bytes until they age out.
+
+    Returns:
+    - List of the deleted paths
+    """
+    max_bytes = STILL_CACHE_MAX_MB * 1024 * 1024 if max_bytes is None else max_bytes
+    entries = []
+    for name in os.listdir(cache_dir):
+        if not name.endswith(".npy"):
+            continue
+        path = os.path.join(cache_dir, name)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            continue  # Removed meanwhile
+        entries.append((stat.st_mtime, stat.st_size, path))
+
+    total = sum(size for _, size, _ in entries)
+    keep = set(keep)
+    in_use_since = time.time() - grace_seconds
+    removed = []
+    for last_used, size, path in sorted(entries):
+        if total <= max_bytes or last_used >= in_use_since:
+            # Sorted by last use, so every remaining still is in use too
+            break
+        if path in keep:
+            continue
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        except OSError:
+            continue  # Still open (e.g. on Windows); try again next time
+        total -= size
+        removed.append(path)
+    return removed
+
+def _prepare_still(image_path, caption, width, height, caption_style, cache_path):
+    """
+    Worker entry point: resize and caption one image and store it in the still cache
+
+    Returns:
+    - Tuple of (cache path or None, error message or None)
+    """
+    try:
+        # Stills are kept in OpenCV's BGR order so frames go to the encoder unconverted
+        still = cv2.cvtColor(resize_image(image_path, width, height), cv2.COLOR_RGB2BGR)
+        if caption:
+            add_caption(still, caption, *caption_style)
+    except Exception as e:
+        return None, f"Error processing image {image_path}: {str(e)}"
+
+    # Write to a private temporary file and rename it into place so that
+    # concurrent renders never see a half-written still
+    tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        np.save(f, np.ascontiguousarray(still))
+    os.replace(tmp_path, cache_path)
+    return cache_path, None
+
+def prepare_stills(items, width=1920, height=1080, caption_style=DEFAULT_CAPTION_STYLE, max_workers=None, cache_dir=STILL_CACHE_DIR):
+    """
+    Produce the resized and captioned still for every image, preparing each distinct one at most once
+
+    Stills already in the cache are memory-mapped straight from disk; the rest are
+    decoded, resized and captioned in parallel across cores and added to the cache,
+    which is then pruned back to STILL_CACHE_MAX_MB.
+
+    Parameters:
+    - items: List of (image path, caption or None) tuples, duplicates allowed
+    - width, height: Size of the video frame
+    - caption_style: (font_scale, thickness, font_path) used for captions
+    - max_workers: Number of worker processes (defaults to the CPU count)
+    - cache_dir: Directory holding the memory-mapped still cache
+
+    Returns:
+    - Tuple of (list of read-only BGR arrays in the same order as items, list of error messages)
+    """
+    global _render_pool
+
+    if not os.path.exists(cache_dir):
+        os.makedirs(cache_dir)
+
+    stills = {}
+    errors = []
+    pending = {}
+    used_paths = []
+
+    # Look every distinct still up in the cache first
+    for image_path, caption in dict.fromkeys(items):
+        try:
+            key = still_cache_key(hash_file(image_path), width, height, caption, caption_style)
+        except OSError as e:
+            errors.append(f"Error processing image {image_path}: {str(e)}")
+            stills[(image_path, caption)] = np.zeros((height, width, 3), dtype=np.uint8)
+            continue
+
+        cache_path = os.path.join(cache_dir, f"{key}.npy")
+        still = load_cached_still(cache_path) if os.path.exists(cache_path) else None
+        if still is not None and still.shape == (height, width, 3):
+            stills[(image_path, caption)] = still
+            used_paths.append(cache_path)
+            try:
+                # Mark it as recently used for pruning
+                os.utime(cache_path)
+            except OSError:
+                pass
+        else:
+            pending[(image_path, caption)] = cache_path
+
+    # Prepare the misses, in parallel unless there is only one
+    jobs = [(path, caption, width, height, caption_style, cache_path) for (path, caption), cache_path in pending.items()]
+    if len(jobs) <= 1:
+        results = [_prepare_still(*job) for job in jobs]
+    else:
+        try:
+            pool = get_render_pool(max_workers)
+            results = list(pool.map(_prepare_still, *zip(*jobs)))
+        except BrokenProcessPool:
+            # A worker died (e.g. killed for memory); drop the pool and finish serially
+            _render_pool = None
+            results = [_prepare_still(*job) for job in jobs]
+
+    for item, (cache_path, error) in zip(pending, results):
+        still = load_cached_still(cache_path) if cache_path else None
+        if still is None:
+            # Return a black image as fallback
+            errors.append(error or f"Error loading prepared image {item[0]}")
+            still = np.zeros((height, width, 3), dtype=np.uint8)
+        else:
+            used_paths.append(cache_path)
+        stills[item] = still
+
+    if pending:
+        prune_still_cache(cache_dir, keep=used_paths)
+
+    return [stills[item] for item in items], errors
+
+@functools.lru_cache(maxsize=64)
+def motion_tables(transition_type, width, height, frame_count):
+    """
+    Precompute the per-frame geometry of a motion transition
+
+    Parameters:
+    - transition_type: A key of MOTION_PATHS
+    - width, height: Size of the video frame
+    - frame_count: Number of frames in the transition
+
+    Returns:
+    - Tuple with the (row slice, column slice) of the source region in view for each frame
+    """
+    path = MOTION_PATHS[transition_type]
+    tables = []
+    for frame_index in range(frame_count):
+        zoom, centre_x, centre_y = path(frame_index / frame_count)
+        view_w = min(width, max(1, round(width / zoom)))
+        view_h = min(height, max(1, round(height / zoom)))
+
+        # Top-left corner of the visible part of the source, kept inside the frame
+        x0 = min(max(round(centre_x * width - view_w / 2), 0), width - view_w)
+        y0 = min(max(round(centre_y * height - view_h / 2), 0), height - view_h)
+
+        tables.append((slice(y0, y0 + view_h), slice(x0, x0 + view_w)))
+    return tuple(tables)
+
+class TransitionRenderer:
+    """
+    Draws transition frames between two stills without allocating per frame
+
+    The output frame and a scratch blend buffer are allocated once per render and
+    overwritten on every call, so the array returned by render() is only valid until
+    the next call. Stills and frames are BGR throughout.
+    """
+
+    def __init__(self, width, height):
+        self.width = width
+        self.height = height
+        self.frame = np.empty((height, width, 3), dtype=np.uint8)
+        self._blend = np.empty_like(self.frame)
+
+    def render(self, img1, img2, transition_type, frame_index, frame_count):
+        """
+        Draw one transition frame
+
+        Parameters:
+        - img1, img2: Outgoing and incoming stills, the same size as the frame
+        - transition_type: One of TRANSITION_TYPES (anything else falls back to fade)
+        - frame_index: Position of this frame in the transition
+        - frame_count: Number of frames in the transition
+
+        Returns:
+        - The renderer's frame buffer holding the result
+        """
+        progress = frame_index / frame_count
+        w = self.width
+        if transition_type == "slide_left":
+            offset = int(progress * w)
+            self.frame[:, 0:w-offset] = img1[:, offset:w]
+            self.frame[:, w-offset:w] = img2[:, 0:offset]
+        elif transition_type == "slide_right":
+            offset = int(progress * w)
+            self.frame[:, offset:w] = img1[:, 0:w-offset]
+            self.frame[:, 0:offset] = img2[:, w-offset:w]
+        elif transition_type in MOTION_PATHS:
+            self._motion(img1, img2, transition_type, frame_index, frame_count)
+        else:  # Default: fade
+            cv2.addWeighted(img1, 1 - progress, img2, progress, 0, dst=self.frame)
+        return self.frame
+
+    def _motion(self, img1, img2, transition_type, frame_index, frame_count):
+        """Cross-fade the stills while moving the camera along the transition's path"""
+        progress = frame_index / frame_count
+        roi = motion_tables(transition_type, self.width, self.height, frame_count)[frame_index]
+
+        # Only the region in view is blended, then scaled once into the output
+        blended = self._blend[roi]
+        cv2.addWeighted(img1[roi], 1 - progress, img2[roi], progress, 0, dst=blended)
+        cv2.resize(blended, (self.width, self.height), dst=self.frame, interpolation=cv2.INTER_LINEAR)
+
+def _center_crop(width, height, target_width, target_height):
+    """Return the slices of the largest centred region of a frame with the target's aspect ratio"""
+    if width * target_height > target_width * height:
+        crop_width = max(1, round(height * target_width / target_height))
+        left = (width - crop_width) // 2
+        return (slice(None), slice(left, left + crop_width))
+    crop_height = max(1, round(width * target_height / target_width))
+    top = (height - crop_height) // 2
+    return (slice(top, top + crop_height), slice(None))
+
+class RenditionWriter:
+    """
+    Feeds every composed frame to one writer per rendition of the video
+
+    Renditions the size of the composed frame get it as is; the others get it
+    cropped to their aspect ratio and resized. The resizes run in parallel threads
+    (OpenCV releases the GIL) and each ffmpeg writer encodes in its own process, so
+    extra renditions reuse the composition and add little wall-clock time. Held
+    frames are resized once however long they are shown.
+    """
+
+    def __init__(self, writers, frame_width, frame_height):
+        """
+        Parameters:
+        - writers: List of (writer, width, height), one per rendition
+        - frame_width, frame_height: Size of the composed frames passed to write()
+        """
+        self._targets = []
+        for writer, width, height in writers:
+            if (width, height) == (frame_width, frame_height):
+                self._targets.append((writer, None, None, None))
+                continue
+            crop = _center_crop(frame_width, frame_height, width, height)
+            crop_width = frame_width if crop[1].start is None else crop[1].stop - crop[1].start
+            interpolation = cv2.INTER_AREA if width < crop_width else cv2.INTER_LINEAR
+            buffer = np.empty((height, width, 3), dtype=np.uint8)
+            self._targets.append((writer, crop, buffer, interpolation))
+        self._threads = ThreadPoolExecutor(max_workers=len(self._targets)) if len(self._targets) > 1 else None
+
+    def _write_target(self, target, frame, repeat):
+        writer, crop, buffer, interpolation = target
+        if crop is not None:
+            cv2.resize(frame[crop], (buffer.shape[1], buffer.shape[0]), dst=buffer, interpolation=interpolation)
+            frame = buffer
+        for _ in range(repeat):
+            writer.write(frame)
+
+    def write(self, frame, repeat=1):
+        """Write a frame (repeat times) to every rendition"""
+        if self._threads is None:
+            self._write_target(self._targets[0], frame, repeat)
+            return
+        # Wait for every rendition before returning, since the caller reuses the frame buffer
+        futures = [self._threads.submit(self._write_target, target, frame, repeat) for target in self._targets]
+        for future in futures:
+            future.result()
+
+    def isOpened(self):
+        return all(target[0].isOpened() for target in self._targets)
+
+    def release(self):
+        """Finish every rendition, raising the first error after releasing them all"""
+        error = None
+        for target in self._targets:
+            try:
+                target[0].release()
+            except Exception as e:
+                error = error or e
+        if self._threads is not None:
+            self._threads.shutdown()
+        if error is not None:
+            raise error
+
+def segment_frames(img1, img2, transition_type, hold_frames, transition_frames, transitions):
+    """
+    Yield the (frame, repeat) pairs of one timeline segment
+
+    A segment holds img1 for hold_frames frames (yielded once), then transitions into
+    img2. The last segment of a video has no img2 and is just the hold.
+
+    Parameters:
+    - img1, img2: BGR stills (img2 may be None)
+    - transition_type: One of TRANSITION_TYPES
+    - hold_frames, transition_frames: Frame counts of the two parts
+    - transitions: TransitionRenderer that draws the transition frames
+    """
+    if hold_frames > 0:
+        yield img1, hold_frames
+    if img2 is not None:
+        for j in range(transition_frames):
+            yield transitions.render(img1, img2, transition_type, j, transition_frames), 1
+
+def _still_ref(still):
+    """Refer to a cached still by its file so workers memory-map it instead of receiving a copy"""
+    if isinstance(still, np.memmap) and still.filename:
+        return still.filename
+    return still
+
+def _load_still(still_ref):
+    """Inverse of _still_ref"""
+    if isinstance(still_ref, str):
+        return np.load(still_ref, mmap_mode='r')
+    return still_ref
+
+def _render_segment(outputs, still_ref, next_still_ref, transition_type, hold_frames, transition_frames, fps, preset, threads):
+    """Worker entry point: encode one segment of the timeline to its own file per rendition"""
+    img1 = _load_still(still_ref)
+    img2 = _load_still(next_still_ref) if next_still_ref is not None else None
+    height, width = img1.shape[:2]
+
+    writer = RenditionWriter(
+        [(FFmpegWriter(path, w, h, fps, preset, threads=threads), w, h) for path, w, h in outputs],
+        width,
+        height
+    )
+    try:
+        transitions = TransitionRenderer(width, height)
+        for frame, repeat in segment_frames(img1, img2, transition_type, hold_frames, transition_frames, transitions):
+            writer.write(frame, repeat)
+    finally:
+        writer.release()
+    return [path for path, _, _ in outputs]
+
+def render_segments_parallel(slides, transition_choices, output_path, fps, hold_frames, transition_frames, preset="balanced", audio_path=None, max_workers=None, scratch_dir=None, on_progress=None, renditions=None):
+    """
+    Render the video as independent segments in parallel and join them losslessly
+
+    Each segment (one still's hold plus its outgoing transition) is encoded by its own
+    worker process, then the segments are concatenated without re-encoding and the
+    music is muxed in. Requires ffmpeg.
+
+    Parameters:
+    - slides: Prepared BGR stills from prepare_stills, in playback order
+    - transition_choices: Transition type into each following slide (len(slides) - 1 entries)
+    - output_path: Path of the MP4 to write
+    - fps, hold_frames, transition_frames: Timing of the video
+    - preset: Key of video_encoder.ENCODER_PRESETS
+    - audio_path: Optional music track
+    - max_workers: Number of worker processes (defaults to the CPU count)
+    - scratch_dir: Directory for the segment files (defaults to the system temp dir)
+    - on_progress: Optional callback called with (fraction done, status message)
+    - renditions: Optional extra versions, as dictionaries with 'output_path', 'width'
+      and 'height', encoded from the same composed frames
+
+    Returns:
+    - output_path
+    """
+    global _render_pool
+
+    height, width = slides[0].shape[:2]
+    outputs = [(output_path, width, height)] + [(r['output_path'], r['width'], r['height']) for r in renditions or []]
+
+    max_workers = max_workers or os.cpu_count() or 1
+    # Share the render's cores (not the whole machine's) between the segments
+    # encoding at once and each of their ffmpeg encoders
+    threads = max(1, max_workers // (min(max_workers, len(slides)) * len(outputs)))
+
+    if scratch_dir and not os.path.exists(scratch_dir):
+        os.makedirs(scratch_dir)
+    segment_dir = tempfile.mkdtemp(prefix="segments_", dir=scratch_dir)
+
+    try:
+        pool = get_render_pool(max_workers)
+        futures = []
+        for i, slide in enumerate(slides):
+            has_next = i + 1 < len(slides)
+            futures.append(pool.submit(
+                _render_segment,
+                [(os.path.join(segment_dir, f"r{k}_segment_{i:04d}.mp4"), w, h) for k, (_, w, h) in enumerate(outputs)],
+                _still_ref(slide),
+                _still_ref(slides[i + 1]) if has_next else None,
+                transition_choices[i] if has_next else None,
+                hold_frames,
+                transition_frames,
+                fps,
+                preset,
+                threads
+            ))
+
+        try:
+            for done, future in enumerate(as_completed(futures), start=1):
+                future.result()
+                if on_progress:
+                    on_progress(done / len(futures), f"Rendered segment {done}/{len(futures)}")
+        except BrokenProcessPool:
+            # A worker died (e.g. killed for memory); don't hand out the broken pool again
+            _render_pool = None
+            raise
+        finally:
+            for future in futures:
+                future.cancel()
+
+        duration = (len(slides) * hold_frames + (len(slides) - 1) * transition_frames) / fps
+        segment_paths = [future.result() for future in futures]
+
+        # Join each rendition's segments, in parallel since each join is its own ffmpeg
+        with ThreadPoolExecutor(max_workers=len(outputs)) as joiners:
+            joins = [
+                joiners.submit(concat_segments, [paths[k] for paths in segment_paths], path, audio_path, duration)
+                for k, (path, _, _) in enumerate(outputs)
+            ]
+            for join in joins:
+                join.result()
+        return output_path
+    finally:
+        shutil.rmtree(segment_dir, ignore_errors=True)
+
+def render_cache_key(images, fps, image_duration, transition_duration, add_captions, width, height, preset, audio_path=None, transition_types=TRANSITION_TYPES):
+    """
+    Build a deterministic key from everything that affects a rendered video
+
+    Images and music are identified by their content, not their file names, so the same
+    trip gets the same key in any session and after a server restart.
+
+    Parameters:
+    - images: List of dictionaries with 'path' and 'caption'
+    - transition_types: Transitions the video's transitions are chosen from
+    - Remaining parameters: The render options passed to render_video
+
+    Returns:
+    - Hex digest identifying the video
+    """
+    key_source = {
+        'version': RENDERER_VERSION,
+        'images': [[hash_file(img['path']), img['caption'] if add_captions else None] for img in images],
+        'fps': fps,
+        'image_duration': image_duration,
+        'transition_duration': transition_duration,
+        'size': [width, height],
+        'preset': preset,
+        'caption_style': DEFAULT_CAPTION_STYLE if add_captions else None,
+        'audio': hash_file(audio_path) if audio_path else None,
+        'transitions': list(transition_types),
+    }
+    return hashlib.sha1(json.dumps(key_source, sort_keys=True).encode()).hexdigest()
+
+def choose_transitions(seed, count, transition_types=TRANSITION_TYPES):
+    """Pick a transition into each following image, the same way every time for a given seed"""
+    rng = random.Random(seed)
+    return [rng.choice(transition_types) for _ in range(count)]
+
+def estimate_render(image_count, fps=24, image_duration=3, transition_duration=1, width=1920, height=1080, preset="balanced", cores=None):
+    """
+    Roughly estimate what a render will cost before starting it
+
+    Parameters:
+    - image_count: Number of images in the video
+    - fps, image_duration, transition_duration, width, height, preset: The render options
+    - cores: Cores the render will get (defaults to the CPU count)
+
+    Returns:
+    - Dictionary with 'frames', 'seconds' (wall-clock estimate) and 'scratch_bytes'
+      (peak disk use for stills, segments and the output)
+    """
+    cores = cores or os.cpu_count() or 1
+    frames = count_frames(image_count, fps, image_duration, transition_duration)
+    megapixels = width * height / 1e6
+
+    cpu_seconds = (
+        image_count * ESTIMATE_PREPARE_SECONDS
+        + frames * megapixels * ESTIMATE_ENCODE_SECONDS_PER_MEGAPIXEL.get(preset, ESTIMATE_ENCODE_SECONDS_PER_MEGAPIXEL["balanced"])
+    )
+    video_bytes = frames * width * height * ESTIMATE_BITS_PER_PIXEL.get(preset, ESTIMATE_BITS_PER_PIXEL["balanced"]) / 8
+    still_bytes = image_count * width * height * 3
+
+    return {
+        'frames': frames,
+        'seconds': cpu_seconds / cores,
+        # Stills in the cache, then the segments and the joined video side by side
+        'scratch_bytes': int(still_bytes + 2 * video_bytes),
+    }
+
+def count_frames(image_count, fps=24, image_duration=3, transition_duration=1):
+    """Return the total number of frames in a video with the given timing"""
+    if image_count <= 0:
+        return 0
+    image_frames = int(fps * image_duration)
+    transition_frames = int(fps * transition_duration)
+    return image_count * image_frames + (image_count - 1) * transition_frames
+
+def generate_frames(slides, transition_choices, fps=24, image_duration=3, transition_duration=1):
+    """
+    Yield (frame, repeat) pairs of BGR frames so they can be fed straight into a video writer
+
+    Static "hold" segments are yielded once with repeat set to the number of frames they
+    last, so each still is only composed once no matter how long it is shown.
+    Transition frames are always yielded with repeat=1 and are drawn into a single
+    reusable buffer, so each yielded frame must be consumed before asking for the next.
+
+    Parameters:
+    - slides: Prepared BGR stills from prepare_stills, in playback order
+    - transition_choices: Transition type into each following slide (len(slides) - 1 entries)
+    - fps, image_duration, transition_duration: Timing of the video
+    """
+    if not slides:
+        return
+
+    # Calculate frame counts
+    image_frames = int(fps * image_duration)
+    transition_frames = int(fps * transition_duration)
+
+    # Transition frames are drawn into buffers allocated once for the whole video
+    height, width = slides[0].shape[:2]
+    transitions = TransitionRenderer(width, height)
+
+    # Process each image and its transition into the next one
+    for i, slide in enumerate(slides):
+        has_next = i + 1 < len(slides)
+        yield from segment_frames(
+            slide,
+            slides[i+1] if has_next else None,
+            transition_choices[i] if has_next else None,
+            image_frames,
+            transition_frames,
+            transitions
+        )
+
+def dump_frames(frames, frames_dir):
+    """Pass (frame, repeat) pairs through unchanged while saving each distinct frame as a JPEG (debug mode only)"""
+    if not os.path.exists(frames_dir):
+        os.makedirs(frames_dir)
+
+    frame_number = 0
+    for frame, repeat in frames:
+        # Held frames are saved once, named after the first frame number they cover
+        cv2.imwrite(os.path.join(frames_dir, f"frame_{frame_number:06d}_x{repeat}.jpg"), frame)
+        frame_number += repeat
+        yield frame, repeat
+
+def open_rendition_writer(outputs, frame_width, frame_height, fps, preset="balanced", audio_path=None, duration=None, threads=0):
+    """
+    Open a writer for each rendition and combine them
+
+    Parameters:
+    - outputs: List of (output path, width, height), one per rendition
+    - frame_width, frame_height: Size of the composed frames
+    - Remaining parameters: As for video_encoder.open_video_writer
+
+    Returns:
+    - RenditionWriter
+    """
+    writers = []
+    for path, width, height in outputs:
+        writer, _ = open_video_writer(path, width, height, fps, preset, audio_path, duration, threads)
+        writers.append((writer, width, height))
+    return RenditionWriter(writers, frame_width, frame_height)
+
+def write_video(frames, output_path, fps=24, width=1920, height=1080, total_frames=None, preset="balanced", audio_path=None, on_progress=None, writer=None, threads=0, renditions=None):
+    """
+    Encode an iterable of (frame, repeat) pairs into a web-playable video as they are produced
+
+    Frames are piped into ffmpeg (with the music track muxed in) when it is installed,
+    otherwise they are written with OpenCV's VideoWriter without sound.
+
+    Parameters:
+    - frames: Iterable of (BGR frame, repeat) pairs, e.g. from generate_frames
+    - output_path: Path of the MP4 to write
+    - fps, width, height: Format of the video
+    - total_frames: Expected number of frames, used for progress reporting and to trim the music
+    - preset: Key of video_encoder.ENCODER_PRESETS
+    - audio_path: Optional music track
+    - on_progress: Optional callback called with (fraction done, status message)
+    - writer: Already opened writer to use instead of opening one for output_path
+    - threads: Encoder threads for ffmpeg (0 lets x264 use every core)
+    - renditions: Optional extra versions, as dictionaries with 'output_path', 'width'
+      and 'height', encoded from the same frames (ignored when writer is given)
+
+    Returns:
+    - output_path
+    """
+    duration = total_frames / fps if total_frames else None
+    if writer is not None:
+        out = writer
+    elif renditions:
+        outputs = [(output_path, width, height)] + [(r['output_path'], r['width'], r['height']) for r in renditions]
+        out = open_rendition_writer(outputs, width, height, fps, preset, audio_path, duration, threads)
+    else:
+        out, _ = open_video_writer(output_path, width, height, fps, preset, audio_path, duration, threads)
+    if not out.isOpened():
+        raise RuntimeError("Could not open a video writer (install FFmpeg or an OpenCV build with H.264 support)")
+
+    # Only report progress about once per percent
+    update_every = max(1, (total_frames or fps) // 100)
+
+    # Write frames to video as soon as they are generated, re-submitting the
+    # same buffer for held frames instead of recomputing them
+    frames_written = 0
+    next_update = update_every
+    try:
+        for frame, repeat in frames:
+            if isinstance(out, RenditionWriter):
+                out.write(frame, repeat)
+            else:
+                for _ in range(repeat):
+                    out.write(frame)
+            frames_written += repeat
+
+            if on_progress and frames_written >= next_update:
+                next_update = frames_written + update_every
+                if total_frames:
+                    on_progress(min(frames_written / total_frames, 1.0), f"Rendering frame {frames_written}/{total_frames}")
+                else:
+                    on_progress(0.0, f"Rendering frame {frames_written}")
+    finally:
+        # Release the video writer
+        out.release()
+
+    if frames_written == 0:
+        raise RuntimeError("No frames were generated for the video")
+
+    return output_path
+
+def render_video(images, output_path, fps=24, image_duration=3, transition_duration=1, add_captions=True, width=1920, height=1080, preset="balanced", audio_path=None, transition_choices=None, debug_frames_dir=None, on_progress=None, stream_dir=None, max_workers=None, renditions=None, scratch_dir=None):
+    """
+    Render the complete cinematic video for a list of images
+
+    Parameters:
+    - images: List of dictionaries with at least 'path' and 'caption'
+    - output_path: Path of the MP4 to write
+    - fps, image_duration, transition_duration: Timing of the video
+    - add_captions: Whether to draw each image's caption on it
+    - width, height: Size of the video
+    - preset: Key of video_encoder.ENCODER_PRESETS
+    - audio_path: Optional music track (only used when ffmpeg is installed)
+    - transition_choices: Transition type into each following image (random when not given)
+    - debug_frames_dir: If set, every distinct frame is also saved there as a JPEG
+    - on_progress: Optional callback called with (fraction done, status message)
+    - stream_dir: If set (and ffmpeg is installed), the video is also written there as
+      an HLS stream that can be played while the render is still running
+    - max_workers: Number of cores the render may use (defaults to the CPU count)
+    - renditions: Optional extra versions of the video (other sizes or aspect ratios),
+      as dictionaries with 'output_path', 'width' and 'height'. They are cropped and
+      resized from the frames composed for the main video and encoded alongside it.
+    - scratch_dir: Directory for temporary files (defaults to data/frames)
+
+    Returns:
+    - Tuple of (output_path, list of warning messages)
+    """
+    if not images:
+        raise ValueError("No images available for video creation")
+
+    def report(fraction, message):
+        if on_progress:
+            on_progress(fraction, message)
+
+    # Decode, resize and caption every distinct image once, in parallel, before
+    # composing any frames (previously prepared stills come from the disk cache)
+    report(0.0, f"Preparing {len(images)} images...")
+    slides, warnings = prepare_stills(
+        [(img['path'], img['caption'] if add_captions else None) for img in images],
+        width,
+        height,
+        max_workers=max_workers
+    )
+
+    # Choose a transition effect for each pair of images (randomize for more variety)
+    if transition_choices is None:
+        transition_choices = choose_transitions(None, len(slides) - 1)
+
+    # Preparing stills counts as the first tenth of the work
+    def report_render(fraction, message):
+        report(0.1 + 0.9 * fraction, message)
+
+    total_frames = count_frames(len(slides), fps, image_duration, transition_duration)
+
+    # A streamed render encodes frames in playback order so the stream's segments
+    # become playable one after the other, then remuxes them into the MP4
+    if stream_dir and ffmpeg_available() and not debug_frames_dir:
+        os.makedirs(stream_dir, exist_ok=True)
+        playlist_path = os.path.join(stream_dir, HLS_PLAYLIST_NAME)
+        writer = FFmpegWriter(
+            playlist_path, width, height, fps, preset, audio_path,
+            duration=total_frames / fps,
+            threads=max_workers or 0,
+            hls_segment_seconds=HLS_SEGMENT_SECONDS
+        )
+        if renditions:
+            # Only the main video is streamed; the other renditions are written as usual
+            writers = [(writer, width, height)]
+            for r in renditions:
+                extra, _ = open_video_writer(r['output_path'], r['width'], r['height'], fps, preset, audio_path, total_frames / fps, max_workers or 0)
+                writers.append((extra, r['width'], r['height']))
+            writer = RenditionWriter(writers, width, height)
+        write_video(
+            generate_frames(slides, transition_choices, fps, image_duration, transition_duration),
+            playlist_path,
+            fps=fps,
+            width=width,
+            height=height,
+            total_frames=total_frames,
+            on_progress=report_render,
+            writer=writer
+        )
+        remux_hls(playlist_path, output_path)
+        return output_path, warnings
+
+    # With FFmpeg the segments are rendered in parallel and joined losslessly
+    if ffmpeg_available() and len(slides) > 1 and not debug_frames_dir:
+        render_segments_parallel(
+            slides,
+            transition_choices,
+            output_path,
+            fps,
+            int(fps * image_duration),
+            int(fps * transition_duration),
+            preset=preset,
+            audio_path=audio_path,
+            max_workers=max_workers,
+            scratch_dir=scratch_dir or os.path.join('data', 'frames'),
+            on_progress=report_render,
+            renditions=renditions
+        )
+        return output_path, warnings
+
+    # Otherwise frames are generated lazily and streamed straight into the writer
+    frames = generate_frames(slides, transition_choices, fps, image_duration, transition_duration)
+    if debug_frames_dir:
+        frames = dump_frames(frames, debug_frames_dir)
+
+    write_video(
+        frames,
+        output_path,
+        fps=fps,
+        width=width,
+        height=height,
+        total_frames=total_frames,
+        preset=preset,
+        audio_path=audio_path,
+        on_progress=report_render,
+        threads=max_workers or 0,
+        renditions=renditions
+    )
+    return output_path, warnings